@@ -0,0 +1,10 @@
+"""
+Công cụ đo hiệu năng cho API gợi ý giá (chạy offline, không gọi tới trang thật)
+
+    python -m bench.standin_server      # Server giả lập các cửa hàng
+    python -m bench.run_replay          # Đo end-to-end get_price_suggestion
+    python -m bench.run_micro           # Micro-benchmark các hàm nóng, so với baseline
+    python -m bench.run_cluster         # Nhiều instance cục bộ, so sánh có/không sharding
+    python -m bench.run_load            # Load test HTTP qua gunicorn, quét số workers x threads
+    python -m bench.record_fixtures     # Ghi lại fixture từ trang thật
+"""
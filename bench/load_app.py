@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Entry point WSGI cho bench.run_load: app như wsgi.py nhưng engine trỏ tới server giả lập
+Chạy: BENCH_STANDIN_URL=http://127.0.0.1:8765 gunicorn -c gunicorn.conf.py bench.load_app:app
+"""
+
+import os
+
+from bench.standin_server import point_engine_at
+from price_suggestion_api import create_app
+
+app = create_app()
+point_engine_at(app.extensions['price_engine'], os.environ['BENCH_STANDIN_URL'])
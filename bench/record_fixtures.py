@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghi lại trang tìm kiếm thật của từng nguồn vào bench/fixtures
+Chỉ chạy khi cần cập nhật fixture (có gọi tới trang thật)
+"""
+
+import argparse
+import os
+import time
+from urllib.parse import quote, urlsplit
+
+import requests
+
+from bench.standin_server import FIXTURES_DIR
+from price_suggestion_api import PriceSuggestionEngine
+
+def search_urls(engine, query: str) -> dict:
+    """URL tìm kiếm của mọi nguồn, theo tên fixture: "<host>.html" hoặc "<host>/<path>.json" cho API"""
+    configs = [source for category in engine.data_sources.values() for source in category['sources']]
+    configs.append(engine.marketplace_sources['chotot'])
+    urls = [(config['search_url'], False) for config in configs]
+    urls += [(config['api_url'], True) for config in configs if 'api_url' in config]
+    urls.append((engine.marketplace_sources['muaban']['search_urls'][0], False))
+
+    by_name = {}
+    for url, is_api in urls:
+        parts = urlsplit(url)
+        host = parts.hostname[4:] if parts.hostname.startswith('www.') else parts.hostname
+        name = f"{host}{parts.path.rstrip('/')}.json" if is_api else f"{host}.html"
+        by_name.setdefault(name, url.format(query=quote(query)))
+    return by_name
+
+def main():
+    parser = argparse.ArgumentParser(description='Ghi lại fixture HTML từ các trang thật')
+    parser.add_argument('--query', default='iPhone 13')
+    parser.add_argument('--only', nargs='*', help='Chỉ ghi các host này')
+    parser.add_argument('--delay', type=float, default=2.0)
+    args = parser.parse_args()
+
+    engine = PriceSuggestionEngine()
+    for name, url in search_urls(engine, args.query).items():
+        host = name.split('/')[0].removesuffix('.html')
+        if args.only and host not in args.only:
+            continue
+        headers = engine.json_headers if name.endswith('.json') else engine.headers
+        try:
+            response = requests.get(url, headers=headers, timeout=15)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"skip {name}: {e}")
+            continue
+
+        path = os.path.join(FIXTURES_DIR, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(response.content)
+        print(f"{name}: {len(response.content)} bytes -> {path}")
+        time.sleep(args.delay)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chạy nhiều instance API cục bộ (mỗi instance một process) trước server giả lập
+So sánh số cache entry và số lần scrape của từng instance khi bật/tắt sharding
+"""
+
+import argparse
+import multiprocessing
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.run_replay import QUERY_MIX
+from bench.standin_server import StandInConfig, StandInServer
+
+def serve_instance(port: int, peers: list, standin_url: str) -> None:
+    """Process con: tạo app với danh sách peer và phục vụ bằng server của werkzeug"""
+    import logging
+    from werkzeug.serving import make_server
+    from bench.standin_server import point_engine_at
+    from price_suggestion_api import create_app
+
+    logging.getLogger('price_suggestion_api').setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app = create_app({
+        'PEERS': peers,
+        'SELF_URL': f"http://127.0.0.1:{port}",
+        'REQUEST_DELAY': 0,
+        'WARM_UP': False
+    })
+    point_engine_at(app.extensions['price_engine'], standin_url)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{url}/health", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+def scrape_count(url: str) -> int:
+    """Tổng price_source_requests_total của một instance"""
+    total = 0
+    for line in requests.get(f"{url}/metrics", timeout=5).text.splitlines():
+        if line.startswith('price_source_requests_total{'):
+            total += float(line.rsplit(' ', 1)[1])
+    return int(total)
+
+def run_cluster(args, sharded: bool, standin_url: str) -> list:
+    ctx = multiprocessing.get_context('spawn')
+    urls = [f"http://127.0.0.1:{args.base_port + i}" for i in range(args.instances)]
+    peers = ','.join(urls) if sharded else ''
+    processes = [ctx.Process(target=serve_instance, args=(args.base_port + i, peers, standin_url), daemon=True)
+                 for i in range(args.instances)]
+    for process in processes:
+        process.start()
+    try:
+        for url in urls:
+            wait_ready(url)
+
+        # Bộ cân bằng tải round-robin: request thứ i tới instance i % n
+        rng = random.Random(args.seed)
+        names = [name for name, _ in QUERY_MIX]
+        weights = [weight for _, weight in QUERY_MIX]
+        workload = [rng.choices(names, weights)[0] for _ in range(args.requests)]
+
+        def one(index_name):
+            index, name = index_name
+            response = requests.get(f"{urls[index % len(urls)]}/api/price-suggestion",
+                                    params={'product_name': name, 'condition': 'nhu-moi'}, timeout=60)
+            return response.status_code, response.headers.get('X-Price-Shard')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(one, enumerate(workload)))
+        wall_time = time.perf_counter() - started
+
+        stats = []
+        for url in urls:
+            health = requests.get(f"{url}/health", timeout=5).json()
+            stats.append({
+                'url': url,
+                'cache_entries': health['cache_entries'],
+                'scrapes': scrape_count(url),
+                'rss_kb': health['memory'].get('rss_kb')
+            })
+        errors = sum(1 for status, _ in outcomes if status != 200)
+        forwarded = sum(1 for _, shard in outcomes if shard)
+        return stats, wall_time, errors, forwarded
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='So sánh nhiều instance có/không sharding')
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=120)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--base-port', type=int, default=5101)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--mode', choices=('sharded', 'replicated', 'both'), default='both')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    server = StandInServer(StandInConfig(latency_ms=args.latency_ms, jitter_ms=0, seed=args.seed)).start()
+    try:
+        modes = ['replicated', 'sharded'] if args.mode == 'both' else [args.mode]
+        for mode in modes:
+            stats, wall_time, errors, forwarded = run_cluster(args, mode == 'sharded', server.base_url)
+            print(f"{mode}: {args.requests} requests in {wall_time:.2f}s, errors={errors}, forwarded={forwarded}")
+            for item in stats:
+                print(f"  {item['url']}  cache_entries={item['cache_entries']:<4} scrapes={item['scrapes']:<5} "
+                      f"rss={item['rss_kb']}kB")
+            print(f"  total cache_entries={sum(i['cache_entries'] for i in stats)} "
+                  f"scrapes={sum(i['scrapes'] for i in stats)}")
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
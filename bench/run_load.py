@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load test qua HTTP: chạy gunicorn (gunicorn.conf.py) trước server giả lập với nhiều cấu hình workers x threads
+Mỗi cấu hình được bắn một bộ truy vấn có trọng số (key nóng/lạnh, nhiều tình trạng) trong một khoảng thời gian,
+báo throughput, p50/p95/p99 và tỉ lệ lỗi theo từng endpoint
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from bench.run_replay import QUERY_MIX, RESULTS_DIR, summarize
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONDITIONS = ['moi', 'nhu-moi', '99%', 'con-bao-hanh', 'het-bao-hanh']
+COLD_SUFFIXES = ['cũ', 'xách tay', 'chính hãng', 'like new', 'fullbox', 'trầy xước nhẹ']
+
+def build_workload(args) -> list:
+    """Danh sách (endpoint, tên sản phẩm, tình trạng, giá): key nóng lặp lại theo QUERY_MIX, key lạnh không lặp"""
+    rng = random.Random(args.seed)
+    names = [name for name, _ in QUERY_MIX]
+    weights = [weight for _, weight in QUERY_MIX]
+    hot_conditions = CONDITIONS[:args.hot_conditions]
+    workload = []
+    for index in range(args.workload_size):
+        name = rng.choices(names, weights)[0]
+        if rng.random() < args.hot_ratio:
+            condition = rng.choice(hot_conditions)
+        else:
+            name = f"{name} {rng.choice(COLD_SUFFIXES)} {index}"
+            condition = rng.choice(CONDITIONS)
+        endpoint = 'validate' if rng.random() < args.validate_ratio else 'suggest'
+        workload.append((endpoint, name, condition, rng.randrange(1_000_000, 40_000_000, 50_000)))
+    return workload
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url}: process exited with {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+def stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def start_standin(args) -> tuple:
+    """Server giả lập chạy ở process riêng để không tranh GIL với client tải"""
+    url = f"http://127.0.0.1:{args.standin_port}"
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'bench.standin_server', '--port', str(args.standin_port),
+         '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+         '--error-rate', str(args.error_rate), '--seed', str(args.seed)],
+        cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_ready(url, process)
+    return url, process
+
+def start_gunicorn(args, workers: int, threads: int, standin_url: str, log_file) -> tuple:
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR,
+        BENCH_STANDIN_URL=standin_url,
+        PRICE_REQUEST_DELAY='0',
+        PRICE_CACHE_DURATION=str(args.cache_duration),
+        PRICE_LOG_LEVEL='WARNING'
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{args.port}",
+         '--workers', str(workers), '--threads', str(threads), '--access-logfile', os.devnull,
+         'bench.load_app:app'],
+        cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    wait_ready(f"{url}/health", process)
+    return url, process
+
+def send(session: requests.Session, url: str, item: tuple, observe_cache: bool) -> tuple:
+    """Gửi một request, trả về (status, cache lookup nếu có, degraded nếu có)"""
+    endpoint, name, condition, price = item
+    headers = {'X-Debug-Timings': '1'} if observe_cache else {}
+    if endpoint == 'suggest':
+        response = session.get(f"{url}/api/price-suggestion", headers=headers, timeout=60,
+                               params={'product_name': name, 'condition': condition})
+    else:
+        response = session.post(f"{url}/api/validate-price", headers=headers, timeout=60,
+                                json={'product_name': name, 'condition': condition, 'price': price})
+    cache = None
+    if observe_cache and response.headers.get('Content-Type', '').startswith('application/json'):
+        cache = (response.json().get('timings') or {}).get('cache')
+    return response.status_code, cache, response.headers.get('X-Price-Degraded')
+
+def run_config(args, url: str, workload: list) -> dict:
+    """Vòng lặp đóng: `concurrency` client, mỗi client gửi request tiếp theo ngay khi nhận xong"""
+    records = []  # (endpoint, latency, status, cache, degraded)
+    lock = threading.Lock()
+    cursor = itertools.count()
+    deadline = time.perf_counter() + args.duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            item = workload[next(cursor) % len(workload)]
+            started = time.perf_counter()
+            try:
+                status, cache, degraded = send(session, url, item, args.observe_cache)
+            except requests.RequestException:
+                status, cache, degraded = 'error', None, None
+            local.append((item[0], time.perf_counter() - started, status, cache, degraded))
+        with lock:
+            records.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    report = {}
+    for endpoint in ('all', 'suggest', 'validate'):
+        selected = [record for record in records if endpoint == 'all' or record[0] == endpoint]
+        if not selected:
+            continue
+        errors = sum(1 for record in selected if record[2] == 'error' or record[2] >= 500)
+        lookups = [record[3] for record in selected if record[3]]
+        report[endpoint] = dict(
+            summarize([record[1] for record in selected]),
+            throughput_rps=round(len(selected) / wall_time, 2),
+            error_rate=round(errors / len(selected), 4),
+            degraded_rate=round(sum(1 for record in selected if record[4]) / len(selected), 4),
+            cache_hit_ratio=round(lookups.count('hit') / len(lookups), 4) if lookups else None
+        )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test HTTP cho /api/price-suggestion và /api/validate-price')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--duration', type=float, default=20, help='Giây đo cho mỗi cấu hình')
+    parser.add_argument('--concurrency', type=int, default=16, help='Số client đồng thời')
+    parser.add_argument('--hot-ratio', type=float, default=0.8, help='Tỉ lệ request dùng key nóng')
+    parser.add_argument('--hot-conditions', type=int, default=2, help='Số tình trạng dùng cho key nóng')
+    parser.add_argument('--validate-ratio', type=float, default=0.3, help='Tỉ lệ request /api/validate-price')
+    parser.add_argument('--workload-size', type=int, default=5000)
+    parser.add_argument('--cache-duration', type=int, default=3600, help='0: mọi request đều scrape')
+    parser.add_argument('--observe-cache', action='store_true',
+                        help='Gửi X-Debug-Timings để đếm cache hit (tốn thêm chút CPU ở server)')
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--standin-port', type=int, default=8766)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='File JSON kết quả (mặc định bench/results/load-<thời gian>.json)')
+    args = parser.parse_args()
+
+    workload = build_workload(args)
+    report = {'timestamp': datetime.now().isoformat(), 'config': vars(args), 'cpu_count': os.cpu_count(),
+              'runs': []}
+    standin_url, standin = start_standin(args)
+    try:
+        for workers, threads in itertools.product(args.workers, args.threads):
+            with tempfile.NamedTemporaryFile('w+', prefix='gunicorn-', suffix='.log', delete=False) as log_file:
+                try:
+                    url, server = start_gunicorn(args, workers, threads, standin_url, log_file)
+                except RuntimeError as e:
+                    print(f"workers={workers} threads={threads}: {e}, log: {log_file.name}")
+                    continue
+                try:
+                    result = run_config(args, url, workload)
+                finally:
+                    stop(server)
+            os.unlink(log_file.name)
+
+            report['runs'].append({'workers': workers, 'threads': threads, 'endpoints': result})
+            overall = result['all']
+            print(f"workers={workers:<2} threads={threads:<2} {overall['throughput_rps']:>8.1f} req/s  "
+                  f"p50={overall['p50_ms']}ms p95={overall['p95_ms']}ms p99={overall['p99_ms']}ms  "
+                  f"errors={overall['error_rate']:.2%} degraded={overall['degraded_rate']:.2%}"
+                  + (f" cache_hit={overall['cache_hit_ratio']:.2%}" if overall['cache_hit_ratio'] is not None else ''))
+    finally:
+        stop(standin)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark cho các hàm chạy trên mọi listing của mỗi request
+Đo ops/giây và bộ nhớ cấp phát, báo lỗi nếu chậm hơn baseline quá ngưỡng
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from bench.standin_server import FIXTURES_DIR
+from price_suggestion_api import PriceSuggestionEngine
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines', 'micro.json')
+
+QUERIES = ['iphone 13', 'samsung galaxy s23', 'macbook air m2', 'tu lanh samsung', 'honda vision']
+
+def read_lines(filename: str) -> list:
+    with open(os.path.join(CORPUS_DIR, filename), encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def build_cases(engine) -> dict:
+    """Mỗi case là (số lần gọi trong một lượt, hàm chạy một lượt)"""
+    titles = read_lines('titles.txt')
+    prices = read_lines('prices.txt')
+    normalized_titles = [engine.normalize_text(title) for title in titles]
+    pairs = [(query, title) for query in QUERIES for title in normalized_titles]
+    soups = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'rb') as f:
+            soups.append((BeautifulSoup(f.read(), 'html.parser'), os.path.basename(path)))
+    price_lists = [[int(1e6 * (i + j % 7)) for j in range(size)] for i, size in enumerate((3, 5, 15, 40))]
+
+    def normalize_text():
+        for title in titles:
+            engine.normalize_text(title)
+
+    def extract_price_from_text():
+        for text in prices:
+            engine.extract_price_from_text(text)
+
+    def is_similar_product():
+        for query, title in pairs:
+            engine.is_similar_product(query, title)
+
+    def detect_product_category():
+        for title in titles:
+            engine.detect_product_category(title)
+
+    def find_product_containers():
+        for soup, name in soups:
+            engine.find_product_containers(soup, name)
+
+    def calculate_price_range():
+        for values in price_lists:
+            engine.calculate_price_range(values, 'nhu-moi')
+
+    return {
+        'normalize_text': (len(titles), normalize_text),
+        'extract_price_from_text': (len(prices), extract_price_from_text),
+        'is_similar_product': (len(pairs), is_similar_product),
+        'detect_product_category': (len(titles), detect_product_category),
+        'find_product_containers': (len(soups), find_product_containers),
+        'calculate_price_range': (len(price_lists), calculate_price_range)
+    }
+
+def measure(calls: int, func, min_time: float, repeat: int) -> dict:
+    # Tốc độ: lấy lượt nhanh nhất trong `repeat` lần, mỗi lần chạy ít nhất `min_time` giây
+    best = None
+    for _ in range(repeat):
+        passes = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            passes += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        rate = passes * calls / elapsed
+        best = rate if best is None else max(best, rate)
+
+    # Bộ nhớ: đỉnh cấp phát trong một lượt và số byte còn giữ lại sau lượt đó
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    return {
+        'ops_per_sec': round(best, 1),
+        'peak_bytes_per_call': round(peak / calls, 1),
+        'retained_bytes': retained
+    }
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, current in report['functions'].items():
+        previous = baseline.get('functions', {}).get(name)
+        if not previous:
+            continue
+        slowdown = (previous['ops_per_sec'] - current['ops_per_sec']) / previous['ops_per_sec'] * 100
+        if slowdown > max_regression:
+            regressions.append(f"{name}: {previous['ops_per_sec']} -> {current['ops_per_sec']} ops/s (-{slowdown:.1f}%)")
+        if previous['peak_bytes_per_call'] and current['peak_bytes_per_call'] > previous['peak_bytes_per_call'] * (1 + max_regression / 100):
+            regressions.append(f"{name}: {previous['peak_bytes_per_call']} -> {current['peak_bytes_per_call']} peak bytes/call")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark các hàm nóng của PriceSuggestionEngine')
+    parser.add_argument('--only', nargs='*', help='Chỉ chạy các hàm này')
+    parser.add_argument('--min-time', type=float, default=0.3)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--max-regression', type=float, default=30.0, help='Ngưỡng chậm hơn cho phép (%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='Ghi kết quả làm baseline mới')
+    parser.add_argument('--output', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    logging.getLogger('price_suggestion_api').setLevel(logging.WARNING)
+    engine = PriceSuggestionEngine()
+    cases = build_cases(engine)
+
+    report = {'python': sys.version.split()[0], 'functions': {}}
+    for name, (calls, func) in cases.items():
+        if args.only and name not in args.only:
+            continue
+        stats = report['functions'][name] = measure(calls, func, args.min_time, args.repeat)
+        print(f"{name:<26} {stats['ops_per_sec']:>12,.0f} ops/s  {stats['peak_bytes_per_call']:>10,.0f} B/call peak")
+
+    for path in filter(None, [args.output, args.save_baseline and args.baseline]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Results written to {path}")
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
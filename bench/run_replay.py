@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark end-to-end get_price_suggestion trên các trang đã ghi (không cần mạng)
+Kết quả ghi ra JSON để so sánh giữa các lần chạy
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bench.standin_server import StandInConfig, StandInServer, point_engine_at
+from price_suggestion_api import PriceSuggestionEngine
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Bộ truy vấn mẫu: (tên sản phẩm, trọng số)
+QUERY_MIX = [
+    ('iPhone 13', 5),
+    ('iPhone 13 Pro 256GB', 3),
+    ('Samsung Galaxy S23', 2),
+    ('MacBook Air M2', 2),
+    ('AirPods Pro', 1),
+    ('Tủ lạnh Samsung Inverter', 2),
+    ('Giày Nike Air Force 1', 1),
+    ('Honda Vision 2023', 2),
+    ('Toyota Vios 2020', 1),
+    ('Căn hộ chung cư Quận 7', 1),
+    ('Nước hoa Chanel', 1)
+]
+
+def percentile(values, p: float) -> float:
+    """Phân vị theo nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def summarize(durations) -> dict:
+    return {
+        'count': len(durations),
+        'mean_ms': round(statistics.mean(durations) * 1000, 3) if durations else 0.0,
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3)
+    }
+
+def instrument_parsers(engine, timings: dict) -> None:
+    """Bọc các hàm parse/scrape của engine để đo thời gian từng parser"""
+    lock = threading.Lock()
+
+    def timed(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with lock:
+                    timings.setdefault(name, []).append(elapsed)
+        return wrapper
+
+    for name in dir(engine):
+        if name.startswith('parse_') or name in ('scrape_chotot_web', 'scrape_muaban'):
+            setattr(engine, name, timed(name, getattr(engine, name)))
+
+def run(args) -> dict:
+    config = StandInConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit, args.seed,
+                           args.padding_kb)
+    server = StandInServer(config).start()
+
+    engine = PriceSuggestionEngine()
+    point_engine_at(engine, server.base_url)
+    engine.request_delay = args.request_delay
+    if not args.warm:
+        # Mỗi lượt đều scrape lại: tắt cache và kho listing
+        engine.cache_duration = 0
+        engine.corpus_min_listings = float('inf')
+
+    parser_timings = {}
+    instrument_parsers(engine, parser_timings)
+
+    rng = random.Random(args.seed)
+    names = [name for name, _ in QUERY_MIX]
+    weights = [weight for _, weight in QUERY_MIX]
+    conditions = list(engine.condition_multipliers)
+    workload = [(rng.choices(names, weights)[0], rng.choice(conditions)) for _ in range(args.iterations)]
+
+    latencies = []
+    errors = 0
+    listings = 0
+
+    def one(product_name, condition):
+        start = time.perf_counter()
+        result = engine.get_price_suggestion(product_name, condition)
+        return time.perf_counter() - start, result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(one, name, condition) for name, condition in workload]
+        for future in futures:
+            try:
+                elapsed, result = future.result()
+                latencies.append(elapsed)
+                listings += sum(1 for item in result['sources'] if item.get('type') != 'estimated')
+            except Exception:
+                errors += 1
+    wall_time = time.perf_counter() - started
+
+    server.stop()
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'end_to_end': dict(
+            summarize(latencies),
+            errors=errors,
+            wall_time_s=round(wall_time, 3),
+            throughput_rps=round(len(latencies) / wall_time, 3) if wall_time else 0.0,
+            real_listings=listings
+        ),
+        'parsers': {name: summarize(durations) for name, durations in sorted(parser_timings.items())},
+        'process': {'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+        'server': {f"{host} {status}": count for (host, status), count in sorted(server.stats.items())}
+    }
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """Liệt kê các chỉ số chậm hơn baseline quá ngưỡng (%)"""
+    regressions = []
+    pairs = [('end_to_end', report['end_to_end'], baseline.get('end_to_end', {}))]
+    pairs += [(f"parsers.{name}", stats, baseline.get('parsers', {}).get(name, {}))
+              for name, stats in report['parsers'].items()]
+
+    for label, current, previous in pairs:
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            before, after = previous.get(metric), current.get(metric)
+            if before and after and (after - before) / before * 100 > max_regression:
+                regressions.append(f"{label}.{metric}: {before} -> {after} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline cho get_price_suggestion')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    parser.add_argument('--padding-kb', type=int, default=0, help='Thêm markup để trang HTML nặng như trang thật')
+    parser.add_argument('--request-delay', type=float, default=0.0, help='Delay giữa các cửa hàng (mặc định tắt)')
+    parser.add_argument('--warm', action='store_true', help='Giữ cache giữa các lượt')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='File JSON kết quả (mặc định bench/results/replay-<thời gian>.json)')
+    parser.add_argument('--baseline', help='File JSON của lần chạy trước để so sánh')
+    parser.add_argument('--max-regression', type=float, default=20.0, help='Ngưỡng chậm hơn cho phép (%%)')
+    args = parser.parse_args()
+
+    logging.getLogger('price_suggestion_api').setLevel(logging.WARNING)
+    report = run(args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"replay-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    e2e = report['end_to_end']
+    print(f"end-to-end: p50={e2e['p50_ms']}ms p95={e2e['p95_ms']}ms p99={e2e['p99_ms']}ms "
+          f"throughput={e2e['throughput_rps']}/s errors={e2e['errors']} listings={e2e['real_listings']} "
+          f"peak_rss={report['process']['peak_rss_kb']}kB")
+    for name, stats in report['parsers'].items():
+        print(f"  {name:<24} n={stats['count']:<4} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms")
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server HTTP giả lập các trang cửa hàng
+Phát lại trang đã ghi trong bench/fixtures với độ trễ, lỗi và giới hạn tốc độ tùy chỉnh
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+class StandInConfig:
+    """Cấu hình hành vi của server giả lập"""
+
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 20, error_rate: float = 0.0,
+                 rate_limit: float = 0.0, seed: int = 42, padding_kb: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate  # Tỉ lệ trả về 500
+        self.rate_limit = rate_limit  # Số request/giây mỗi host, 0 = không giới hạn
+        self.seed = seed
+        self.padding_kb = padding_kb  # Thêm markup menu/footer để trang HTML nặng như trang thật
+
+class StandInServer:
+    """Server phát lại fixture, URL dạng http://127.0.0.1:<port>/<host>/<path gốc>"""
+
+    def __init__(self, config: StandInConfig = None, host: str = '127.0.0.1', port: int = 0,
+                 fixtures_dir: str = FIXTURES_DIR):
+        self.config = config or StandInConfig()
+        self.fixtures_dir = fixtures_dir
+        self.fixtures = self._load_fixtures()
+        self.random = random.Random(self.config.seed)
+        self.buckets = {}  # host -> (tokens, last_refill)
+        self.stats = {}  # (host, status) -> count
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _load_fixtures(self) -> dict:
+        """Key là "<host>" (trang tìm kiếm) hoặc "<host>/<path>" cho fixture trong thư mục con (API JSON)"""
+        fixtures = {}
+        for root, _, filenames in os.walk(self.fixtures_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                name, ext = os.path.splitext(os.path.relpath(path, self.fixtures_dir))
+                content_type = {
+                    '.html': 'text/html; charset=utf-8',
+                    '.json': 'application/json; charset=utf-8'
+                }.get(ext)
+                if content_type:
+                    with open(path, 'rb') as f:
+                        body = f.read()
+                    if ext == '.html' and self.config.padding_kb:
+                        body = body.replace(b'</body>', self._padding(self.config.padding_kb) + b'</body>', 1)
+                    fixtures[name.replace(os.sep, '/')] = (body, content_type)
+        return fixtures
+
+    @staticmethod
+    def _padding(size_kb: int) -> bytes:
+        """Markup nhiều node (menu danh mục) không chứa sản phẩm"""
+        block = ''.join(f'<li><a href="/c/{i}"><span>Danh mục {i}</span></a></li>' for i in range(40))
+        block = f'<nav><ul>{block}</ul></nav>\n'.encode('utf-8')
+        return block * max(1, size_kb * 1024 // len(block))
+
+    def find_fixture(self, host: str, path: str):
+        """Tìm fixture theo host và path, nếu không có thì theo host (bỏ "www.")"""
+        if host.startswith('www.'):
+            host = host[4:]
+        return self.fixtures.get(host + path.rstrip('/')) or self.fixtures.get(host)
+
+    def _take_token(self, host: str) -> bool:
+        """Token bucket theo host: False nếu vượt giới hạn tốc độ"""
+        rate = self.config.rate_limit
+        if rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(host, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            self.buckets[host] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def _record(self, host: str, status: int) -> None:
+        with self.lock:
+            self.stats[(host, status)] = self.stats.get((host, status), 0) + 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                host, _, path = parts.path.lstrip('/').partition('/')
+                config = server.config
+
+                with server.lock:
+                    delay = config.latency_ms + server.random.uniform(-config.jitter_ms, config.jitter_ms)
+                    failed = server.random.random() < config.error_rate
+                time.sleep(max(delay, 0) / 1000)
+
+                if not server._take_token(host):
+                    self._reply(host, 429, b'Too Many Requests', 'text/plain', {'Retry-After': '1'})
+                elif failed:
+                    self._reply(host, 500, b'Internal Server Error', 'text/plain')
+                else:
+                    fixture = server.find_fixture(host, '/' + path)
+                    if fixture is None:
+                        self._reply(host, 404, b'Not Found', 'text/plain')
+                    else:
+                        body, content_type = fixture
+                        self._reply(host, 200, body, content_type)
+
+            def _reply(self, host, status, body, content_type, extra_headers=None):
+                server._record(host, status)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (extra_headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'StandInServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='standin-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def point_engine_at(engine, base_url: str) -> None:
+    """Chuyển mọi URL tìm kiếm của engine sang server giả lập"""
+    def rewrite(url: str) -> str:
+        return url.replace('https://', base_url.rstrip('/') + '/', 1)
+
+    for category_info in engine.data_sources.values():
+        for source_config in category_info['sources']:
+            for key in ('search_url', 'api_url', 'page_url'):
+                if key in source_config:
+                    source_config[key] = rewrite(source_config[key])
+
+    for marketplace in engine.marketplace_sources.values():
+        for key in ('search_url', 'api_url', 'page_url'):
+            if key in marketplace:
+                marketplace[key] = rewrite(marketplace[key])
+        if 'search_urls' in marketplace:
+            marketplace['search_urls'] = [rewrite(url) for url in marketplace['search_urls']]
+
+def main():
+    parser = argparse.ArgumentParser(description='Server giả lập các cửa hàng cho benchmark')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='request/giây mỗi host (0 = tắt)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--padding-kb', type=int, default=0, help='Thêm markup để trang nặng hơn')
+    args = parser.parse_args()
+
+    config = StandInConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit, args.seed,
+                           args.padding_kb)
+    server = StandInServer(config, args.host, args.port)
+    print(f"Stand-in store server on {server.base_url} ({len(server.fixtures)} fixtures)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Cấu hình gunicorn: master nạp app một lần rồi fork các worker gthread
+Engine, bảng giá tham khảo và cache regex/selector được dùng chung copy-on-write
+"""
+
+import gc
+import multiprocessing
+import os
+import time
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('PRICE_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('PRICE_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('PRICE_THREADS', 8))
+preload_app = True  # Tạo app trong master trước khi fork
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+_boot_started = time.perf_counter()
+
+def when_ready(server):
+    from price_suggestion_api import process_memory
+    # Đưa các object đã tạo vào vùng "permanent" để GC không chạm tới, tránh copy-on-write ở worker
+    gc.freeze()
+    server.log.info(f"Master ready in {time.perf_counter() - _boot_started:.3f}s, memory: {process_memory()}")
+
+def post_worker_init(worker):
+    from price_suggestion_api import process_memory
+    # Luồng nền không tồn tại qua fork nên khởi động trong từng worker
+    # worker.wsgi là app gunicorn đã nạp (wsgi:app hoặc app truyền trên dòng lệnh)
+    engine = worker.wsgi.extensions['price_engine']
+    engine.start_refresh_scheduler()
+    engine.start_snapshot_scheduler()  # Không làm gì nếu chưa đặt PRICE_SNAPSHOT_PATH
+    worker.log.info(f"Worker {worker.pid} ready, memory: {process_memory()}")
@@ -5,37 +5,1260 @@ API gợi ý giá cho hệ thống Mine
 Sử dụng web scraping để thu thập dữ liệu từ các trang bán đồ cũ
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, current_app, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 import requests
 from bs4 import BeautifulSoup
 import re
+import os
+import gzip
+import mmap
+import struct
+import zlib
+import io
+import tempfile
+import hashlib
+import hmac
+import csv
 import time
 import json
+import gc
+import tracemalloc
+from itertools import combinations, islice
 import urllib.parse
 from urllib.parse import quote
 from typing import List, Dict, Optional
 import statistics
 import unicodedata
 import logging
+import logging.handlers
+import queue
+import atexit
 from urllib.parse import quote
 import random
-from datetime import datetime, timedelta
+import sys
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import deque, Counter as CounterDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError  # Chỉ trùng với TimeoutError từ Python 3.11
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 
-app = Flask(__name__)
-CORS(app)
+try:
+    import brotli  # Tùy chọn: nén br cho client hỗ trợ
+except ImportError:
+    brotli = None
 
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO)
+# Cấu hình logging: request thread chỉ đẩy record vào hàng đợi, luồng nền format và ghi ra stderr
+LOG_SAMPLED = {'sampled': True}  # extra= cho log lặp theo từng item, bị giới hạn bởi LogRateLimiter
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Đưa record nguyên trạng vào hàng đợi; việc ghép msg % args để luồng ghi log làm"""
+    
+    def prepare(self, record):
+        return record
+
+class LogRateLimiter(logging.Filter):
+    """Mỗi mẫu log (record.msg) có extra=LOG_SAMPLED chỉ ghi tối đa `burst` lần mỗi `interval` giây"""
+    
+    def __init__(self, burst: int = 5, interval: float = 60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}  # msg -> [bắt đầu cửa sổ, số đã ghi, số bị bỏ]
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(record.msg)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self.windows[record.msg] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (%s similar messages suppressed)"
+                    record.args = tuple(record.args or ()) + (suppressed,)
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """Mỗi record một dòng JSON"""
+    
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+_log_listener = None
+
+def configure_logging(level: str = 'INFO', json_format: bool = False) -> None:
+    """Như logging.basicConfig (không làm gì nếu root đã có handler) nhưng ghi log qua QueueListener"""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter() if json_format else logging.Formatter(logging.BASIC_FORMAT))
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    def start_listener():
+        global _log_listener
+        _log_listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+        _log_listener.start()
+    
+    def restart_in_child():
+        # Luồng ghi log không tồn tại qua fork (worker gunicorn): tạo hàng đợi và luồng mới
+        queue_handler.queue = queue.SimpleQueue()
+        start_listener()
+    
+    start_listener()
+    os.register_at_fork(after_in_child=restart_in_child)
+    atexit.register(lambda: _log_listener.stop())
+
+configure_logging(os.environ.get('PRICE_LOG_LEVEL', 'INFO'), os.environ.get('PRICE_LOG_FORMAT') == 'json')
 logger = logging.getLogger(__name__)
+logger.addFilter(LogRateLimiter())
+
+class ShardedMetric:
+    """Metric kiểu Prometheus, mỗi luồng ghi vào shard riêng nên không cần khóa khi ghi"""
+    
+    FOLD_EVERY = 64  # Cứ mỗi bấy nhiêu shard mới thì gộp shard của luồng đã chết, kể cả khi không ai collect
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards = []  # (thread, values)
+        self._retired = {}  # Giá trị của các luồng đã kết thúc
+        self._registrations = 0
+        self._lock = threading.Lock()
+    
+    def _shard(self) -> Dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+                self._registrations += 1
+                if self._registrations % self.FOLD_EVERY == 0:
+                    self._fold_retired()
+            return values
+    
+    def _merge(self, total, value):
+        return total + value
+    
+    def _fold_retired(self) -> List[Dict]:
+        """Gộp hẳn shard của luồng đã chết vào _retired (gọi khi đang giữ _lock), trả về các shard còn sống"""
+        live = []
+        shards = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                live.append(values)
+                shards.append((thread, values))
+            else:
+                for labels, value in list(values.items()):
+                    self._retired[labels] = self._merge(self._retired[labels], value) if labels in self._retired else value
+        self._shards = shards
+        return live
+    
+    def collect(self) -> Dict:
+        """Gộp giá trị của mọi shard; shard của luồng đã chết được gộp hẳn vào _retired"""
+        with self._lock:
+            live = self._fold_retired()
+            merged = {labels: self._copy(value) for labels, value in self._retired.items()}
+        
+        for values in live:
+            for labels, value in list(values.items()):
+                merged[labels] = self._merge(merged[labels], value) if labels in merged else self._copy(value)
+        return merged
+    
+    def _copy(self, value):
+        return value
+    
+    def _format_labels(self, labels: tuple, extra: tuple = ()) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{self._format_labels(labels)} {value}")
+        return lines
+
+class Counter(ShardedMetric):
+    metric_type = 'counter'
+    
+    def inc(self, *labels, amount: float = 1) -> None:
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+class Gauge(ShardedMetric):
+    """Gauge chỉ hỗ trợ inc/dec để có thể cộng dồn theo shard"""
+    metric_type = 'gauge'
+    
+    def inc(self, *labels, amount: float = 1) -> None:
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+    
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+class Histogram(ShardedMetric):
+    metric_type = 'histogram'
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value: float, *labels) -> None:
+        values = self._shard()
+        cells = values.get(labels)
+        if cells is None:
+            # Số đếm từng bucket (không cộng dồn), bucket +Inf, tổng, số lần
+            cells = values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+    
+    def _merge(self, total, value):
+        return [a + b for a, b in zip(total, value)]
+    
+    def _copy(self, value):
+        return list(value)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, cells in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), cells):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {cells[-2]}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cells[-1]}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric: ShardedMetric) -> ShardedMetric:
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# Metrics dùng chung cho engine và các route
+metrics = MetricsRegistry()
+REQUEST_LATENCY = metrics.register(Histogram(
+    'price_api_request_duration_seconds', 'HTTP request latency by route', ('route', 'method')))
+SOURCE_FETCH_LATENCY = metrics.register(Histogram(
+    'price_source_fetch_duration_seconds', 'Time spent downloading a source search page', ('source',)))
+SOURCE_PARSE_LATENCY = metrics.register(Histogram(
+    'price_source_parse_duration_seconds', 'Time spent parsing a source search page', ('source',)))
+SOURCE_REQUESTS = metrics.register(Counter(
+    'price_source_requests_total', 'Source scrapes by outcome (success, error, timeout)', ('source', 'outcome')))
+SOURCE_LISTINGS = metrics.register(Counter(
+    'price_source_listings_total', 'Listings extracted per source', ('source',)))
+CACHE_LOOKUPS = metrics.register(Counter(
+    'price_cache_lookups_total', 'Suggestion cache lookups by result (hit, miss, stale)', ('result',)))
+SCRAPES_IN_FLIGHT = metrics.register(Gauge(
+    'price_scrapes_in_flight', 'Source scrapes currently running', ('source',)))
+OUTBOUND_QUEUE_WAIT = metrics.register(Histogram(
+    'price_outbound_queue_wait_seconds', 'Time fetches waited for an outbound slot by priority class', ('priority',)))
+SHARD_FORWARDS = metrics.register(Counter(
+    'price_shard_forwards_total', 'Requests for products owned by another instance by outcome (forwarded, failed)', ('outcome',)))
+ADMISSION_QUEUED = metrics.register(Gauge(
+    'price_admission_queued', 'Cold scrapes waiting for an admission slot'))
+ADMISSION_SHED = metrics.register(Counter(
+    'price_admission_shed_total', 'Cold scrapes shed under overload by fallback (stale, estimated, rejected)', ('fallback',)))
+
+# Thời gian chi tiết theo request, chỉ bật khi client gửi header X-Debug-Timings
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+class RequestTimings:
+    """Cộng dồn thời gian từng giai đoạn (toàn request và theo từng nguồn)"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.sources = {}
+        self.annotations = {}
+        self.lock = threading.Lock()
+    
+    def add(self, phase: str, seconds: float, source: Optional[str] = None) -> None:
+        with self.lock:
+            target = self.sources.setdefault(source, {}) if source else self.phases
+            target[phase] = target.get(phase, 0) + seconds
+    
+    def to_dict(self) -> Dict:
+        def ms(seconds):
+            return round(seconds * 1000, 3)
+        
+        with self.lock:
+            return dict(self.annotations,
+                        total_ms=ms(time.perf_counter() - self.started),
+                        phases={phase: ms(value) for phase, value in self.phases.items()},
+                        sources={source: {phase: ms(value) for phase, value in phases.items()}
+                                 for source, phases in self.sources.items()})
+
+def record_timing(phase: str, seconds: float, source: Optional[str] = None) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds, source)
+
+def annotate_timing(key: str, value) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.annotations[key] = value
+
+@contextmanager
+def timed_phase(phase: str, source: Optional[str] = None):
+    if _request_timings.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - started, source)
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> CounterDict:
+    """Lấy mẫu stack của mọi luồng trong `seconds` giây, trả về dạng collapsed stack -> số mẫu"""
+    samples = CounterDict()
+    own_id = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            samples[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    
+    return samples
+
+class AllocationTracer:
+    """Bật/tắt tracemalloc theo yêu cầu và giữ vài snapshot có tên để so sánh (mỗi worker một bộ riêng)
+    
+    Khi chưa bật thì không tốn gì: tracemalloc chỉ chạy giữa start() và stop()
+    """
+    
+    def __init__(self, max_snapshots: int = 4):
+        self.max_snapshots = max_snapshots
+        self.snapshots = {}  # name -> (snapshot, thời điểm chụp)
+        self.lock = threading.Lock()
+    
+    def start(self, frames: int = 1) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, min(frames, 25)))
+    
+    def stop(self) -> None:
+        tracemalloc.stop()
+        with self.lock:
+            self.snapshots.clear()
+    
+    def take(self, name: Optional[str] = None):
+        """Chụp snapshot (bỏ qua bộ nhớ của chính tracemalloc); có tên thì lưu lại, bỏ snapshot cũ nhất khi đầy"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not running')
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+        ])
+        if name:
+            with self.lock:
+                self.snapshots.pop(name, None)
+                while len(self.snapshots) >= self.max_snapshots:
+                    del self.snapshots[next(iter(self.snapshots))]
+                self.snapshots[name] = (snapshot, time.time())
+        return snapshot
+    
+    def get(self, name: str):
+        with self.lock:
+            if name not in self.snapshots:
+                raise KeyError(name)
+            return self.snapshots[name][0]
+    
+    def top(self, snapshot, group_by: str = 'lineno', limit: int = 25) -> List[Dict]:
+        return [self._format(stat) for stat in snapshot.statistics(group_by)[:limit]]
+    
+    def diff(self, base, against, group_by: str = 'lineno', limit: int = 25) -> List[Dict]:
+        """Các vị trí tăng/giảm nhiều nhất giữa hai snapshot"""
+        return [self._format(stat) for stat in against.compare_to(base, group_by)[:limit]]
+    
+    def status(self) -> Dict:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            snapshots = [{'name': name, 'taken_at': datetime.fromtimestamp(taken_at).isoformat(),
+                          'traced_kb': round(sum(trace.size for trace in snapshot.traces) / 1024, 1)}
+                         for name, (snapshot, taken_at) in self.snapshots.items()]
+        return {
+            'tracing': tracing,
+            'frames': tracemalloc.get_traceback_limit() if tracing else 0,
+            'traced_kb': round(current / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'overhead_kb': round(tracemalloc.get_tracemalloc_memory() / 1024, 1),
+            'snapshots': snapshots
+        }
+    
+    @staticmethod
+    def _format(stat) -> Dict:
+        frames = [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+        item = {
+            'location': frames[0] if len(frames) == 1 else frames,
+            'size_kb': round(stat.size / 1024, 1),
+            'count': stat.count
+        }
+        if hasattr(stat, 'size_diff'):
+            item['size_diff_kb'] = round(stat.size_diff / 1024, 1)
+            item['count_diff'] = stat.count_diff
+        return item
+
+allocation_tracer = AllocationTracer()  # tracemalloc là trạng thái của cả process nên dùng chung một bộ
+
+_live_objects_lock = threading.Lock()
+_live_objects_cache = {}  # 'at': thời điểm đếm, 'result': kết quả
+
+def count_live_objects(type_names: tuple = (), limit: int = 20, max_objects: int = 2_000_000,
+                       min_interval: float = 30) -> Optional[Dict]:
+    """Đếm object còn sống theo kiểu (duyệt heap qua gc, chỉ gọi khi cần chẩn đoán)
+    
+    Mỗi lần tối đa max_objects object, chỉ một lượt chạy cùng lúc (lượt khác nhận None),
+    và kết quả được dùng lại trong min_interval giây để không ai gọi dồn làm nghẽn worker
+    """
+    if not _live_objects_lock.acquire(blocking=False):
+        return None
+    try:
+        cached = _live_objects_cache.get('result')
+        if cached is not None and time.time() - _live_objects_cache['at'] < min_interval:
+            return dict(cached, age_seconds=round(time.time() - _live_objects_cache['at'], 1))
+        
+        objects = gc.get_objects()
+        counts = CounterDict(type(obj).__name__ for obj in islice(objects, max_objects))
+        result = {
+            'top': dict(counts.most_common(limit)),
+            'watched': {name: counts.get(name, 0) for name in type_names},
+            'uncollectable': len(gc.garbage),
+            'scanned': min(len(objects), max_objects),
+            'truncated': len(objects) > max_objects
+        }
+        del objects
+        _live_objects_cache.update(at=time.time(), result=result)
+        return dict(result, age_seconds=0)
+    finally:
+        _live_objects_lock.release()
+
+class SpaceSavingCounter:
+    """Đếm tần suất truy vấn với bộ nhớ giới hạn (thuật toán Space-Saving)
+    
+    Số đếm giảm một nửa sau mỗi `decay_interval` giây (về 0 thì bỏ key), để key chỉ phổ biến một thời không nằm mãi trong top
+    """
+    
+    def __init__(self, capacity: int = 1000, decay_interval: float = 3600):
+        self.capacity = capacity
+        self.decay_interval = decay_interval
+        self.last_decay = time.time()
+        self.counts = {}  # key -> (count, error, lần truy vấn gần nhất)
+        self.lock = threading.Lock()
+    
+    def _decay(self, now: float) -> None:
+        # Gọi khi đang giữ lock
+        while now - self.last_decay >= self.decay_interval:
+            self.last_decay += self.decay_interval
+            self.counts = {key: (count // 2, error // 2, seen)
+                           for key, (count, error, seen) in self.counts.items() if count // 2}
+    
+    def add(self, key: str, weight: int = 1):
+        now = time.time()
+        with self.lock:
+            self._decay(now)
+            if key in self.counts:
+                count, error, _ = self.counts[key]
+                self.counts[key] = (count + weight, error, now)
+            elif len(self.counts) < self.capacity:
+                self.counts[key] = (weight, 0, now)
+            else:
+                # Thay key ít phổ biến nhất, kế thừa số đếm của nó làm sai số
+                victim = min(self.counts, key=lambda k: self.counts[k][0])
+                victim_count, _, _ = self.counts.pop(victim)
+                self.counts[key] = (victim_count + weight, victim_count, now)
+    
+    def top(self, k: int) -> List[tuple]:
+        """Trả về k key phổ biến nhất dạng (key, count, lần truy vấn gần nhất)"""
+        with self.lock:
+            self._decay(time.time())
+            items = sorted(self.counts.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, seen) for key, (count, _, seen) in items[:k]]
+    
+    def export(self) -> Dict:
+        with self.lock:
+            return {key: list(value) for key, value in self.counts.items()}
+    
+    def restore(self, state: Dict) -> None:
+        with self.lock:
+            for key, value in state.items():
+                if key not in self.counts and len(self.counts) < self.capacity:
+                    count, error = value[:2]
+                    self.counts[key] = (count, error, value[2] if len(value) > 2 else 0)  # Snapshot cũ không có thời điểm
+
+class EngineOverloaded(Exception):
+    """Không còn chỗ cho scrape mới; route trả 503 kèm Retry-After"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many cold scrapes, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Giới hạn số scrape chạy đồng thời, hàng đợi có giới hạn; quá tải thì từ chối ngay thay vì dồn luồng
+    
+    Scrape không phải interactive (batch, background) chỉ được giữ tối đa `max_batch` slot
+    và nhường lượt khi có request interactive đang chờ
+    """
+    
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, queue_timeout: float = 5, retry_after: int = 10,
+                 max_batch: int = 2):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.queue_timeout = queue_timeout  # Chờ slot tối đa bao lâu trước khi bị loại
+        self.retry_after = retry_after
+        self.running = 0
+        self.batch_running = 0
+        self.waiting = 0
+        self.interactive_waiting = 0
+        self.condition = threading.Condition()
+    
+    def _can_run(self, interactive: bool) -> bool:
+        if self.running >= self.max_concurrent:
+            return False
+        return interactive or (self.batch_running < self.max_batch and not self.interactive_waiting)
+    
+    @contextmanager
+    def slot(self, priority: str = 'interactive'):
+        interactive = priority == 'interactive'
+        with self.condition:
+            if not self._can_run(interactive):
+                if self.waiting >= self.max_queue:
+                    raise EngineOverloaded(self.retry_after)
+                self.waiting += 1
+                self.interactive_waiting += interactive
+                ADMISSION_QUEUED.inc()
+                try:
+                    admitted = self.condition.wait_for(lambda: self._can_run(interactive), self.queue_timeout)
+                finally:
+                    self.waiting -= 1
+                    self.interactive_waiting -= interactive
+                    ADMISSION_QUEUED.dec()
+                if not admitted:
+                    # Batch đang chờ có thể vừa được mở khóa vì hết request interactive chờ
+                    self.condition.notify_all()
+                    raise EngineOverloaded(self.retry_after)
+            self.running += 1
+            self.batch_running += not interactive
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.batch_running -= not interactive
+                self.condition.notify_all()
+
+# Lớp ưu tiên của các fetch trong luồng/context hiện tại (interactive, batch, background)
+_fetch_priority = contextvars.ContextVar('fetch_priority', default='interactive')
+
+@contextmanager
+def fetch_priority(priority: str):
+    token = _fetch_priority.set(priority)
+    try:
+        yield
+    finally:
+        _fetch_priority.reset(token)
+
+class OutboundScheduler:
+    """Cấp slot cho mọi request ra ngoài: giới hạn tổng và theo host, ưu tiên interactive
+    
+    Chống đói: mỗi `aging_seconds` chờ thì request được nâng một bậc ưu tiên
+    """
+    
+    PRIORITIES = ('interactive', 'batch', 'background')
+    
+    def __init__(self, max_concurrent: int = 8, max_per_host: int = 2, aging_seconds: float = 2.0):
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.aging_seconds = aging_seconds
+        self.running = 0
+        self.hosts = {}  # host -> số request đang chạy
+        self.queues = {priority: deque() for priority in self.PRIORITIES}
+        self.condition = threading.Condition()
+    
+    @contextmanager
+    def slot(self, host: str, priority: str = 'interactive'):
+        """Chờ tới lượt rồi trả về số giây đã chờ"""
+        ticket = {'host': host, 'enqueued': time.monotonic(), 'granted': False}
+        with self.condition:
+            self.queues[priority].append(ticket)
+            self._dispatch()
+            while not ticket['granted']:
+                self.condition.wait()
+        waited = time.monotonic() - ticket['enqueued']
+        OUTBOUND_QUEUE_WAIT.observe(waited, priority)
+        try:
+            yield waited
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.hosts[host] -= 1
+                if not self.hosts[host]:
+                    del self.hosts[host]
+                self._dispatch()
+    
+    def _dispatch(self) -> None:
+        # Gọi khi đang giữ lock: cấp slot cho các ticket có điểm thấp nhất (bậc ưu tiên trừ thời gian chờ)
+        granted = False
+        while self.running < self.max_concurrent:
+            now = time.monotonic()
+            best = None
+            for rank, priority in enumerate(self.PRIORITIES):
+                for ticket in self.queues[priority]:
+                    if self.hosts.get(ticket['host'], 0) < self.max_per_host:
+                        score = rank - (now - ticket['enqueued']) / self.aging_seconds
+                        if best is None or score < best[0]:
+                            best = (score, priority, ticket)
+                        break  # FIFO trong cùng lớp: chỉ xét ticket đầu tiên chạy được
+            if best is None:
+                break
+            _, priority, ticket = best
+            self.queues[priority].remove(ticket)
+            ticket['granted'] = True
+            self.running += 1
+            self.hosts[ticket['host']] = self.hosts.get(ticket['host'], 0) + 1
+            granted = True
+        if granted:
+            self.condition.notify_all()
+
+class HashRing:
+    """Vòng băm nhất quán: mỗi node có `replicas` điểm ảo, thêm/bớt node chỉ chuyển phần key lân cận"""
+    
+    def __init__(self, nodes: List[str], replicas: int = 100):
+        self.replicas = replicas
+        points = sorted((self.hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+    
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+    
+    def owner(self, key: str) -> Optional[str]:
+        if not self.hashes:
+            return None
+        index = bisect_left(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.nodes[index]
+
+class ShardRouter:
+    """Chia sản phẩm cho các instance theo vòng băm; request không thuộc instance này được chuyển tới chủ
+    
+    Peer không kết nối được bị loại khỏi vòng trong `down_seconds` giây rồi tự được thêm lại;
+    peer trả lời chậm (hết `timeout` khi đang đọc) vẫn ở trong vòng vì nó chỉ đang scrape
+    """
+    
+    FORWARDED_HEADER = 'X-Price-Forwarded-By'
+    REQUEST_HEADERS = ('Content-Type', 'Accept', 'If-None-Match', 'If-Modified-Since')
+    RESPONSE_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Content-Location',
+                        'Retry-After', 'X-Price-Degraded')
+    
+    def __init__(self, self_url: str, peers: List[str], replicas: int = 100, timeout: float = 90,
+                 down_seconds: float = 30, connect_timeout: float = 3):
+        self.self_url = self_url.rstrip('/')
+        self.replicas = replicas
+        self.timeout = timeout  # Phải lớn hơn thời gian scrape lạnh xấu nhất của peer
+        self.connect_timeout = connect_timeout
+        self.down_seconds = down_seconds
+        self.down = {}  # peer -> thời điểm được thử lại
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.set_peers(peers)
+    
+    def set_peers(self, peers: List[str]) -> None:
+        peers = [peer.rstrip('/') for peer in peers if peer.strip()]
+        with self.lock:
+            self.peers = sorted(set(peers) | {self.self_url})
+            self.down = {peer: until for peer, until in self.down.items() if peer in self.peers}
+            self._rebuild()
+    
+    def _rebuild(self) -> None:
+        self.ring = HashRing([peer for peer in self.peers if peer not in self.down], self.replicas)
+    
+    def owner(self, key: str) -> str:
+        if self.down:
+            now = time.time()
+            with self.lock:
+                expired = [peer for peer, until in self.down.items() if until <= now]
+                if expired:
+                    for peer in expired:
+                        del self.down[peer]
+                    self._rebuild()
+        return self.ring.owner(key) or self.self_url
+    
+    def mark_down(self, peer: str) -> None:
+        with self.lock:
+            self.down[peer] = time.time() + self.down_seconds
+            self._rebuild()
+    
+    def forward(self, peer: str, req) -> requests.Response:
+        headers = {name: req.headers[name] for name in self.REQUEST_HEADERS if name in req.headers}
+        headers[self.FORWARDED_HEADER] = self.self_url
+        headers['Accept-Encoding'] = 'identity'  # Instance này tự nén khi trả cho client
+        url = peer + req.full_path.rstrip('?')
+        return self.session.request(req.method, url, data=req.get_data(), headers=headers,
+                                    timeout=(self.connect_timeout, self.timeout), allow_redirects=False)
+
+def get_json_path(data, path: str):
+    """Lấy giá trị theo đường dẫn "a.b.c" (chỉ số list dạng "items.0"), None nếu thiếu"""
+    for key in path.split('.'):
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and key.isdigit() and int(key) < len(data):
+            data = data[int(key)]
+        else:
+            return None
+    return data
+
+# Snapshot trạng thái engine: MAGIC, version (uint32), độ dài header (uint64), header JSON, các khối zlib(JSON)
+SNAPSHOT_MAGIC = b'PRICESNAP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREFIX = struct.Struct('>9sIQ')
+
+def encode_cache_entry(entry: Dict) -> bytes:
+    return zlib.compress(json.dumps(dict(entry, timestamp=entry['timestamp'].timestamp()),
+                                    ensure_ascii=False).encode('utf-8'))
+
+def decode_cache_entry(blob: bytes) -> Dict:
+    entry = json.loads(zlib.decompress(blob))
+    entry['timestamp'] = datetime.fromtimestamp(entry['timestamp'])
+    return entry
+
+class SnapshotBackedCache(dict):
+    """Cache gợi ý giá; entry nạp từ snapshot nằm trong vùng mmap và chỉ được giải mã khi được tra lần đầu"""
+    
+    def __init__(self):
+        super().__init__()
+        self.buffer = None
+        self.pending = {}  # key -> (offset, length, timestamp) trong buffer
+        self.lock = threading.Lock()
+    
+    def attach(self, buffer, pending: Dict) -> None:
+        with self.lock:
+            self.buffer = buffer
+            self.pending = {key: location for key, location in pending.items() if not dict.__contains__(self, key)}
+    
+    def _promote(self, key) -> bool:
+        with self.lock:
+            location = self.pending.pop(key, None)
+            if location is None:
+                return dict.__contains__(self, key)
+            offset, length, _ = location
+            try:
+                entry = decode_cache_entry(self.buffer[offset:offset + length])
+            except (ValueError, TypeError, KeyError, zlib.error) as e:
+                # Entry hỏng trong snapshot: coi như cache miss, request sẽ scrape lại
+                logger.warning("Dropping corrupt snapshot cache entry %s: %s", key, e)
+                return False
+            dict.__setitem__(self, key, entry)
+            return True
+    
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or (bool(self.pending) and self._promote(key))
+    
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    
+    def __setitem__(self, key, value) -> None:
+        if self.pending:
+            with self.lock:
+                self.pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+    
+    def __len__(self) -> int:
+        return dict.__len__(self) + len(self.pending)
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'loaded': dict.__len__(self),
+                'pending': len(self.pending),
+                'mapped_kb': len(self.buffer) // 1024 if self.buffer is not None else 0
+            }
+    
+    def encoded_items(self, since: float):
+        """(key, blob, timestamp) của các entry mới hơn `since`; entry chưa giải mã được chép nguyên khối"""
+        with self.lock:
+            loaded = list(dict.items(self))
+            pending = [(key, self.buffer[offset:offset + length], timestamp)
+                       for key, (offset, length, timestamp) in self.pending.items() if timestamp >= since]
+        return [(key, encode_cache_entry(entry), entry['timestamp'].timestamp())
+                for key, entry in loaded if entry['timestamp'].timestamp() >= since] + pending
+
+class Listing:
+    """Một listing giá; dùng __slots__ thay cho dict để giảm bộ nhớ, vẫn đọc được kiểu listing['price']"""
+    
+    __slots__ = ('title', 'price', 'source', 'url', 'type')
+    
+    def __init__(self, title: str, price: int, source: str, url: str, type: Optional[str] = None):
+        self.title = title
+        self.price = price
+        self.source = sys.intern(source)
+        self.url = url
+        self.type = sys.intern(type) if type else None
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+    
+    def to_dict(self) -> Dict:
+        """Dạng JSON giống dict cũ (chỉ có 'type' khi được đặt)"""
+        data = {'title': self.title, 'price': self.price, 'source': self.source, 'url': self.url}
+        if self.type:
+            data['type'] = self.type
+        return data
+
+class ListingCorpus:
+    """Kho listing đã scrape, đánh chỉ mục ngược theo từ trong tiêu đề đã chuẩn hóa"""
+    
+    def __init__(self, max_age: int = 3600, max_size: int = 50000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.listings = {}  # (source, title) -> (listing, normalized_title, timestamp)
+        self.index = {}  # word -> set of (source, title)
+        self.lock = threading.Lock()
+    
+    def add(self, listings: List[Dict], normalize) -> None:
+        now = time.time()
+        with self.lock:
+            for listing in listings:
+                key = (listing['source'], listing['title'])
+                normalized_title = normalize(listing['title'])
+                if key in self.listings:
+                    self._unindex(key)
+                self.listings[key] = (listing, normalized_title, now)
+                for word in set(normalized_title.split()):
+                    self.index.setdefault(word, set()).add(key)
+            
+            if len(self.listings) > self.max_size:
+                self._evict(now)
+    
+    def search(self, normalized_query: str, is_similar, limit: int = 15) -> List[Dict]:
+        """Tìm listing còn mới có tiêu đề tương đồng với truy vấn"""
+        cutoff = time.time() - self.max_age
+        with self.lock:
+            # Jaccard > 0 cần ít nhất một từ chung, nên chỉ xét các posting list của truy vấn
+            candidates = set()
+            for word in set(normalized_query.split()):
+                candidates.update(self.index.get(word, ()))
+            
+            matches = []
+            for key in candidates:
+                listing, normalized_title, timestamp = self.listings[key]
+                if timestamp >= cutoff and is_similar(normalized_query, normalized_title):
+                    matches.append((timestamp, listing))
+        
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return [listing for _, listing in matches[:limit]]
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'listings': len(self.listings),
+                'index_words': len(self.index),
+                'index_postings': sum(len(keys) for keys in self.index.values())
+            }
+    
+    def export(self) -> List[list]:
+        with self.lock:
+            return [[listing.title, listing.price, listing.source, listing.url, listing.type, normalized_title, timestamp]
+                    for listing, normalized_title, timestamp in self.listings.values()]
+    
+    def restore(self, rows: List[list]) -> None:
+        """Nạp lại listing từ snapshot (giữ thời điểm scrape gốc), bỏ qua listing đã hết hạn hoặc đã có"""
+        cutoff = time.time() - self.max_age
+        with self.lock:
+            for title, price, source, url, type, normalized_title, timestamp in rows:
+                listing = Listing(title, price, source, url, type)
+                key = (listing.source, title)
+                if timestamp < cutoff or key in self.listings:
+                    continue
+                self.listings[key] = (listing, normalized_title, timestamp)
+                for word in set(normalized_title.split()):
+                    self.index.setdefault(word, set()).add(key)
+    
+    def _unindex(self, key) -> None:
+        _, normalized_title, _ = self.listings.pop(key)
+        for word in set(normalized_title.split()):
+            keys = self.index.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.index[word]
+    
+    def _evict(self, now: float) -> None:
+        """Xóa listing hết hạn, sau đó xóa listing cũ nhất nếu vẫn vượt giới hạn"""
+        cutoff = now - self.max_age
+        for key in [key for key, (_, _, ts) in self.listings.items() if ts < cutoff]:
+            self._unindex(key)
+        
+        overflow = len(self.listings) - self.max_size
+        if overflow > 0:
+            oldest = sorted(self.listings, key=lambda key: self.listings[key][2])[:overflow]
+            for key in oldest:
+                self._unindex(key)
+
+class P2Quantile:
+    """Ước lượng phân vị theo luồng với bộ nhớ cố định (thuật toán P²)"""
+    
+    __slots__ = ('p', 'heights', 'positions', 'desired', 'increments')
+    
+    def __init__(self, p: float):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+    
+    def add(self, x: float) -> None:
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(x)
+            heights.sort()
+            return
+        
+        # Tìm ô chứa x và cập nhật các marker ở hai đầu
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if heights[i] <= x < heights[i + 1])
+        
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        
+        # Điều chỉnh 3 marker ở giữa bằng nội suy parabol (hoặc tuyến tính)
+        positions = self.positions
+        for i in range(1, 4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = heights[i] + d / (positions[i + 1] - positions[i - 1]) * (
+                    (positions[i] - positions[i - 1] + d) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+                    + (positions[i + 1] - positions[i] - d) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1])
+                )
+                if not heights[i - 1] < candidate < heights[i + 1]:
+                    candidate = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = candidate
+                positions[i] += d
+    
+    def to_state(self) -> list:
+        return [self.p, self.heights, self.positions, self.desired]
+    
+    @classmethod
+    def from_state(cls, state: list) -> 'P2Quantile':
+        quantile = cls(state[0])
+        quantile.heights, quantile.positions, quantile.desired = state[1], state[2], state[3]
+        return quantile
+    
+    def value(self) -> float:
+        if not self.heights:
+            return 0
+        if len(self.heights) < 5 or self.positions[4] <= 5:
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+class PriceRollup:
+    """Tổng hợp giá của một ngày, cập nhật dần theo từng quan sát
+    
+    P² chỉ đáng tin khi có nhiều quan sát: tới EXACT_LIMIT giá thì giữ nguyên mẫu và tính phân vị chính xác,
+    vượt ngưỡng mới chuyển sang P² (bộ nhớ cố định)
+    """
+    
+    __slots__ = ('count', 'total', 'min_price', 'max_price', 'samples', 'quantiles')
+    
+    QUANTILES = (0.25, 0.5, 0.75)
+    EXACT_LIMIT = 50
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min_price = None
+        self.max_price = None
+        self.samples = []  # None khi đã chuyển sang P²
+        self.quantiles = None
+    
+    def add(self, price: int) -> None:
+        self.count += 1
+        self.total += price
+        self.min_price = price if self.min_price is None else min(self.min_price, price)
+        self.max_price = price if self.max_price is None else max(self.max_price, price)
+        if self.samples is None:
+            for quantile in self.quantiles:
+                quantile.add(price)
+            return
+        
+        self.samples.append(price)
+        if len(self.samples) > self.EXACT_LIMIT:
+            self.quantiles = [P2Quantile(q) for q in self.QUANTILES]
+            for sample in self.samples:
+                for quantile in self.quantiles:
+                    quantile.add(sample)
+            self.samples = None
+    
+    def quantile_values(self) -> List[float]:
+        """p25, trung vị, p75 (chính xác theo statistics.quantiles khi còn giữ mẫu)"""
+        if self.samples is None:
+            return [quantile.value() for quantile in self.quantiles]
+        if len(self.samples) < 2:
+            return [self.samples[0] if self.samples else 0] * len(self.QUANTILES)
+        return statistics.quantiles(self.samples, n=4, method='inclusive')
+    
+    def to_state(self) -> list:
+        quantiles = [q.to_state() for q in self.quantiles] if self.quantiles is not None else None
+        return [self.count, self.total, self.min_price, self.max_price, quantiles, self.samples]
+    
+    @classmethod
+    def from_state(cls, state: list) -> 'PriceRollup':
+        rollup = cls()
+        rollup.count, rollup.total, rollup.min_price, rollup.max_price = state[:4]
+        if state[4] is not None:
+            # Snapshot cũ không có mẫu: luôn dùng P²
+            rollup.quantiles = [P2Quantile.from_state(q) for q in state[4]]
+            rollup.samples = None
+        else:
+            rollup.samples = list(state[5])
+        return rollup
+    
+    def to_dict(self) -> Dict:
+        p25, median, p75 = (int(value) for value in self.quantile_values())
+        return {
+            'count': self.count,
+            'min_price': self.min_price,
+            'max_price': self.max_price,
+            'average_price': int(self.total / self.count) if self.count else 0,
+            'median_price': median,
+            'p25_price': p25,
+            'p75_price': p75
+        }
+
+class PriceHistoryStore:
+    """Lịch sử giá theo sản phẩm chuẩn hóa, lưu dưới dạng rollup theo ngày"""
+    
+    def __init__(self, retention_days: int = 365, recent_size: int = 200):
+        self.retention_days = retention_days
+        self.recent_size = recent_size
+        self.series = {}  # canonical product -> {'days': {date: PriceRollup}, 'recent': deque}
+        self.lock = threading.Lock()
+    
+    def record(self, product_key: str, prices: List[int], when: Optional[datetime] = None) -> None:
+        when = when or datetime.now()
+        day = when.date().isoformat()
+        with self.lock:
+            series = self.series.setdefault(product_key, {'days': {}, 'recent': deque(maxlen=self.recent_size)})
+            rollup = series['days'].get(day)
+            if rollup is None:
+                rollup = series['days'][day] = PriceRollup()
+                self._expire(series['days'], when)
+            
+            timestamp = when.timestamp()
+            for price in prices:
+                rollup.add(price)
+                series['recent'].append((timestamp, price))
+    
+    def query(self, product_key: str, days: int = 30) -> List[Dict]:
+        """Trả về rollup theo ngày trong khoảng `days` ngày gần nhất"""
+        since = (datetime.now() - timedelta(days=days)).date().isoformat()
+        with self.lock:
+            series = self.series.get(product_key)
+            if not series:
+                return []
+            buckets = [dict(date=day, **rollup.to_dict())
+                       for day, rollup in series['days'].items() if day >= since]
+        
+        return sorted(buckets, key=lambda bucket: bucket['date'])
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'products': len(self.series),
+                'daily_rollups': sum(len(series['days']) for series in self.series.values()),
+                'recent_prices': sum(len(series['recent']) for series in self.series.values())
+            }
+    
+    def export(self) -> Dict:
+        with self.lock:
+            return {key: {'days': {day: rollup.to_state() for day, rollup in series['days'].items()},
+                          'recent': list(series['recent'])}
+                    for key, series in self.series.items()}
+    
+    def restore(self, state: Dict) -> None:
+        """Nạp lịch sử từ snapshot cho các sản phẩm chưa có dữ liệu trong process này"""
+        with self.lock:
+            for key, series in state.items():
+                if key in self.series:
+                    continue
+                self.series[key] = {
+                    'days': {day: PriceRollup.from_state(rollup) for day, rollup in series['days'].items()},
+                    'recent': deque((tuple(item) for item in series['recent']), maxlen=self.recent_size)
+                }
+    
+    def _expire(self, days: Dict, now: datetime) -> None:
+        cutoff = (now - timedelta(days=self.retention_days)).date().isoformat()
+        for day in [day for day in days if day < cutoff]:
+            del days[day]
+
+class ReferencePriceTable:
+    """Bảng giá tham khảo đọc từ file JSON/CSV, đánh chỉ mục theo tập từ của tên model"""
+    
+    def __init__(self, path: str, tokenize, reload_interval: int = 5):
+        self.path = path
+        self.tokenize = tokenize
+        self.reload_interval = reload_interval
+        self.tables = {}  # category -> {frozenset(tokens): prices}
+        self.vocabularies = {}  # category -> tập mọi từ xuất hiện trong tên model
+        self.max_key_tokens = 0
+        self.mtime = None
+        self.last_check = 0
+        self.lock = threading.Lock()
+        self.reload()
+    
+    def reload(self) -> None:
+        """Đọc lại file và thay thế chỉ mục (không chặn các lượt tra cứu đang chạy)"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if self.path.endswith('.csv'):
+                raw = self._read_csv()
+            else:
+                with open(self.path, encoding='utf-8') as f:
+                    raw = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot load reference prices from %s: %s", self.path, e)
+            return
+        
+        tables = {}
+        max_key_tokens = 0
+        for category, models in raw.items():
+            table = tables[category] = {}
+            for names, prices in models.items():
+                # Một model có thể có nhiều tên, phân tách bằng "|"
+                for name in names.split('|'):
+                    tokens = frozenset(['default'] if name == 'default' else self.tokenize(name))
+                    if tokens:
+                        table.setdefault(tokens, prices)
+                        max_key_tokens = max(max_key_tokens, len(tokens))
+        vocabularies = {category: frozenset().union(*table) for category, table in tables.items()}
+        
+        self.tables, self.vocabularies, self.max_key_tokens, self.mtime = tables, vocabularies, max_key_tokens, mtime
+        logger.info("Loaded %s reference prices from %s", sum(len(t) for t in tables.values()), self.path)
+    
+    def _read_csv(self) -> Dict:
+        """CSV gồm các cột: category, model, low, mid, high"""
+        raw = {}
+        with open(self.path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                prices = [int(row[column]) for column in ('low', 'mid', 'high')]
+                raw.setdefault(row['category'], {})[row['model']] = prices
+        return raw
+    
+    def maybe_reload(self) -> None:
+        now = time.time()
+        if now - self.last_check < self.reload_interval:
+            return
+        with self.lock:
+            if now - self.last_check < self.reload_interval:
+                return
+            self.last_check = now
+            try:
+                changed = os.path.getmtime(self.path) != self.mtime
+            except OSError:
+                changed = False
+        if changed:
+            self.reload()
+    
+    def lookup(self, category: str, query_tokens: List[str]) -> Optional[List[int]]:
+        """Tìm model có nhiều từ nhất mà mọi từ đều xuất hiện trong truy vấn"""
+        self.maybe_reload()
+        tables, vocabularies = self.tables, self.vocabularies
+        if category not in tables:
+            category = 'electronics'
+        table = tables.get(category, {})
+        
+        # Duyệt các tập con của truy vấn từ lớn đến nhỏ: chi phí không phụ thuộc kích thước bảng
+        # Chỉ giữ các từ có trong tên model của bảng rồi mới giới hạn 8 từ, để từ thừa không đẩy mất từ khóa
+        vocabulary = vocabularies.get(category, frozenset())
+        words = sorted(set(query_tokens) & vocabulary)[:8]
+        for size in range(min(len(words), self.max_key_tokens), 0, -1):
+            for subset in combinations(words, size):
+                prices = table.get(frozenset(subset))
+                if prices:
+                    return prices
+        
+        return table.get(frozenset(['default']))
 
 class PriceSuggestionEngine:
     def __init__(self):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        self.cache = {}  # Cache kết quả trong 1 giờ
+        self.json_headers = dict(self.headers, Accept='application/json')
+        self.cache = SnapshotBackedCache()  # Cache kết quả trong 1 giờ
         self.cache_duration = 3600  # 1 giờ
+        self.request_delay = 1  # Nghỉ giữa các cửa hàng để tránh bị block
         
         # Mapping tình trạng sản phẩm với % giá
         self.condition_multipliers = {
@@ -47,6 +1270,10 @@ class PriceSuggestionEngine:
         }
         
         # Cấu hình nguồn dữ liệu theo danh mục
+        # fetch_mode 'json': gọi api_url của cửa hàng và lấy field theo json_fields thay vì parse HTML
+        # (items/item/title/price là đường dẫn dạng "a.b", url là template theo field của item)
+        # page_url: template cho các trang kết quả sau trang đầu ({page} từ 2, hoặc {offset} = (page - 1) * page_size),
+        # với nguồn JSON là URL của API
         self.data_sources = {
             'electronics': {
                 'name': 'Đồ điện tử',
@@ -55,6 +1282,7 @@ class PriceSuggestionEngine:
                         'name': 'Phong Vũ',
                         'base_url': 'https://phongvu.vn',
                         'search_url': 'https://phongvu.vn/tim-kiem?q={query}',
+                        'page_url': 'https://phongvu.vn/tim-kiem?q={query}&page={page}',
                         'price_selector': '.price-current',
                         'title_selector': '.product-name',
                         'active': True
@@ -63,6 +1291,7 @@ class PriceSuggestionEngine:
                         'name': 'CellphoneS',
                         'base_url': 'https://cellphones.com.vn',
                         'search_url': 'https://cellphones.com.vn/tim-kiem?q={query}',
+                        'page_url': 'https://cellphones.com.vn/tim-kiem?q={query}&page={page}',
                         'price_selector': '.product-price',
                         'title_selector': '.product-name',
                         'active': True
@@ -71,6 +1300,7 @@ class PriceSuggestionEngine:
                         'name': 'Thế Giới Di Động',
                         'base_url': 'https://thegioididong.com',
                         'search_url': 'https://thegioididong.com/tim-kiem?q={query}',
+                        'page_url': 'https://thegioididong.com/tim-kiem?q={query}&pi={page}',
                         'price_selector': '.price',
                         'title_selector': '.name',
                         'active': True
@@ -84,6 +1314,7 @@ class PriceSuggestionEngine:
                         'name': 'Điện Máy Xanh',
                         'base_url': 'https://dienmayxanh.com',
                         'search_url': 'https://dienmayxanh.com/tim-kiem?q={query}',
+                        'page_url': 'https://dienmayxanh.com/tim-kiem?q={query}&pi={page}',
                         'price_selector': '.price',
                         'title_selector': '.name',
                         'active': True
@@ -92,6 +1323,7 @@ class PriceSuggestionEngine:
                         'name': 'Nguyễn Kim',
                         'base_url': 'https://nguyenkim.com',
                         'search_url': 'https://nguyenkim.com/tim-kiem?q={query}',
+                        'page_url': 'https://nguyenkim.com/tim-kiem?q={query}&p={page}',
                         'price_selector': '.product-price',
                         'title_selector': '.product-name',
                         'active': True
@@ -102,6 +1334,11 @@ class PriceSuggestionEngine:
                         'search_url': 'https://tiki.vn/tim-kiem?q={query}&category=1882',
                         'price_selector': '.product-price',
                         'title_selector': '.product-name',
+                        'fetch_mode': 'json',
+                        'api_url': 'https://tiki.vn/api/v2/products?q={query}&category=1882&limit=40',
+                        'page_url': 'https://tiki.vn/api/v2/products?q={query}&category=1882&limit=40&page={page}',
+                        'json_fields': {'items': 'data', 'title': 'name', 'price': 'price',
+                                        'url': 'https://tiki.vn/{url_path}'},
                         'active': True
                     }
                 ]
@@ -113,6 +1350,7 @@ class PriceSuggestionEngine:
                         'name': 'ZALORA',
                         'base_url': 'https://zalora.vn',
                         'search_url': 'https://zalora.vn/tim-kiem/?q={query}',
+                        'page_url': 'https://zalora.vn/tim-kiem/?q={query}&page={page}',
                         'price_selector': '.price-current',
                         'title_selector': '.product-name',
                         'active': True
@@ -123,6 +1361,11 @@ class PriceSuggestionEngine:
                         'search_url': 'https://lazada.vn/tim-kiem/?q={query}&from=input&spm=a2o4n.searchlist.search.go.2b2a52e6wHjsE7',
                         'price_selector': '.pdp-price',
                         'title_selector': '.pdp-product-name',
+                        'fetch_mode': 'json',
+                        'api_url': 'https://www.lazada.vn/catalog/?ajax=true&q={query}',
+                        'page_url': 'https://www.lazada.vn/catalog/?ajax=true&q={query}&page={page}',
+                        'json_fields': {'items': 'mods.listItems', 'title': 'name', 'price': 'price',
+                                        'url': 'https:{itemUrl}'},
                         'active': True
                     },
                     {
@@ -131,6 +1374,12 @@ class PriceSuggestionEngine:
                         'search_url': 'https://shopee.vn/search?keyword={query}&category=17',
                         'price_selector': '.shopee-price',
                         'title_selector': '.shopee-item-name',
+                        'fetch_mode': 'json',
+                        'api_url': 'https://shopee.vn/api/v4/search/search_items?by=relevancy&keyword={query}&limit=30&match_id=17&page_type=search',
+                        'page_url': 'https://shopee.vn/api/v4/search/search_items?by=relevancy&keyword={query}&limit=30&match_id=17&newest={offset}&page_type=search',
+                        'page_size': 30,
+                        'json_fields': {'items': 'items', 'item': 'item_basic', 'title': 'name', 'price': 'price',
+                                        'price_divisor': 100000, 'url': 'https://shopee.vn/product/{shopid}/{itemid}'},
                         'active': True
                     }
                 ]
@@ -142,6 +1391,7 @@ class PriceSuggestionEngine:
                         'name': 'Oto.com.vn',
                         'base_url': 'https://oto.com.vn',
                         'search_url': 'https://oto.com.vn/tim-kiem?q={query}',
+                        'page_url': 'https://oto.com.vn/tim-kiem?q={query}&page={page}',
                         'price_selector': '.price',
                         'title_selector': '.car-name',
                         'active': True
@@ -152,6 +1402,12 @@ class PriceSuggestionEngine:
                         'search_url': 'https://xe.chotot.com/tim-kiem?q={query}',
                         'price_selector': '.ad-price',
                         'title_selector': '.ad-title',
+                        'fetch_mode': 'json',
+                        'api_url': 'https://gateway.chotot.com/v1/public/ad-listing?cg=2000&q={query}&limit=20',
+                        'page_url': 'https://gateway.chotot.com/v1/public/ad-listing?cg=2000&q={query}&limit=20&o={offset}',
+                        'page_size': 20,
+                        'json_fields': {'items': 'ads', 'title': 'subject', 'price': 'price',
+                                        'url': 'https://xe.chotot.com/{list_id}.htm'},
                         'active': True
                     }
                 ]
@@ -163,6 +1419,7 @@ class PriceSuggestionEngine:
                         'name': 'Batdongsan.com.vn',
                         'base_url': 'https://batdongsan.com.vn',
                         'search_url': 'https://batdongsan.com.vn/tim-kiem?q={query}',
+                        'page_url': 'https://batdongsan.com.vn/tim-kiem/p{page}?q={query}',
                         'price_selector': '.price',
                         'title_selector': '.product-title',
                         'active': True
@@ -176,6 +1433,7 @@ class PriceSuggestionEngine:
                         'name': 'Watsons Vietnam',
                         'base_url': 'https://watsons.vn',
                         'search_url': 'https://watsons.vn/tim-kiem?q={query}',
+                        'page_url': 'https://watsons.vn/tim-kiem?q={query}&currentPage={page}',
                         'price_selector': '.price',
                         'title_selector': '.product-name',
                         'active': True
@@ -184,17 +1442,40 @@ class PriceSuggestionEngine:
             }
         }
         
-        # Keywords để tự động phân loại sản phẩm
+        # Các chợ đồ cũ (URL tìm kiếm, {query} được thay bằng tên sản phẩm)
+        # categories: các danh mục dùng chợ này (None: mọi danh mục)
+        self.marketplace_sources = {
+            'chotot': {
+                'categories': ['electronics'],  # cg=5000 là mục đồ điện tử
+                'search_url': 'https://www.chotot.com/tp-ho-chi-minh/mua-ban-dien-tu?q={query}',
+                'fetch_mode': 'json',
+                'api_url': 'https://gateway.chotot.com/v1/public/ad-listing?region_v2=13000&cg=5000&q={query}&limit=20',
+                'json_fields': {'items': 'ads', 'title': 'subject', 'price': 'price',
+                                'url': 'https://www.chotot.com/{list_id}.htm'}
+            },
+            'muaban': {
+                'categories': None,
+                'search_urls': [
+                    'https://muaban.net/tim-kiem?q={query}',
+                    'https://muaban.net/search?keyword={query}',
+                    'https://www.muaban.net/tim-kiem/{query}'
+                ]
+            }
+        }
+        
+        # Keywords để tự động phân loại sản phẩm (khớp theo cả từ sau khi chuẩn hóa;
+        # keyword có ở nhiều danh mục, như thương hiệu, được chia đều điểm giữa các danh mục đó)
         self.category_keywords = {
             'electronics': [
                 'iphone', 'samsung', 'laptop', 'macbook', 'ipad', 'airpods', 
-                'watch', 'camera', 'ps5', 'xbox', 'nintendo', 'smartphone',
-                'tablet', 'computer', 'mouse', 'keyboard', 'headphone', 'speaker'
+                'watch', 'camera', 'ps5', 'xbox', 'nintendo', 'smartphone', 'galaxy',
+                'tablet', 'computer', 'mouse', 'keyboard', 'headphone', 'speaker',
+                'điện thoại', 'máy tính', 'tai nghe', 'loa'
             ],
             'home_appliances': [
                 'tủ lạnh', 'máy giặt', 'điều hòa', 'ti vi', 'tv', 'lò vi sóng',
                 'nồi cơm điện', 'máy lọc nước', 'quạt', 'bàn ghế', 'giường',
-                'tủ quần áo', 'sofa', 'bàn ăn'
+                'tủ quần áo', 'sofa', 'bàn ăn', 'máy phát điện', 'honda', 'samsung'
             ],
             'fashion': [
                 'áo', 'quần', 'váy', 'giày', 'túi xách', 'đồng hồ', 'kính',
@@ -202,7 +1483,8 @@ class PriceSuggestionEngine:
             ],
             'vehicles': [
                 'xe máy', 'ô tô', 'xe hơi', 'xe đạp', 'honda', 'yamaha',
-                'toyota', 'hyundai', 'mazda', 'ford', 'vinfast'
+                'toyota', 'hyundai', 'mazda', 'ford', 'vinfast',
+                'vision', 'wave', 'air blade', 'exciter', 'sirius', 'vios'
             ],
             'real_estate': [
                 'nhà', 'căn hộ', 'chung cư', 'đất', 'villa', 'biệt thự',
@@ -213,6 +1495,148 @@ class PriceSuggestionEngine:
                 'nước hoa', 'thuốc', 'vitamin', 'thực phẩm chức năng'
             ]
         }
+        
+        # Chuẩn hóa truy vấn trước khi tra cache: từ viết tắt -> tên đầy đủ
+        self.query_aliases = {
+            'ip': 'iphone',
+            'ss': 'samsung',
+            'tl': 'tủ lạnh',
+            'mg': 'máy giặt',
+            'mbp': 'macbook pro',
+            'mba': 'macbook air',
+            'tv': 'ti vi'
+        }
+        # Bỏ màu sắc để các biến thể dùng chung một cache entry; dung lượng ảnh hưởng tới giá nên mặc định giữ lại
+        self.strip_storage_tokens = False
+        self.strip_color_tokens = True
+        self.storage_token_pattern = re.compile(r'^\d+(?:gb|tb|g|t)$')
+        self.color_tokens = {
+            'đen', 'trắng', 'xanh', 'đỏ', 'vàng', 'hồng', 'tím', 'xám', 'bạc', 'cam',
+            'black', 'white', 'blue', 'red', 'gold', 'silver', 'pink', 'purple',
+            'green', 'gray', 'grey', 'midnight', 'starlight'
+        }
+        self._build_query_alias_index()
+        self._build_category_index()
+        
+        # Làm mới trước hạn cho các sản phẩm được hỏi nhiều nhất
+        self.query_popularity = SpaceSavingCounter(capacity=1000)
+        self.refresh_top_k = 50
+        self.refresh_ahead_seconds = 300  # Làm mới khi còn < 5 phút TTL
+        self.refresh_interval = 60
+        self.refresh_budget_per_cycle = 5  # Số lần scrape tối đa mỗi chu kỳ
+        self._refresh_thread = None
+        
+        # Kho listing cục bộ để trả lời truy vấn mà không cần scrape lại
+        self.listing_corpus = ListingCorpus(max_age=self.cache_duration)
+        self.corpus_min_listings = 5
+        
+        # Lịch sử giá thị trường để theo dõi xu hướng
+        self.price_history = PriceHistoryStore()
+        
+        # Kiểm soát tải: số scrape đồng thời và hàng đợi có giới hạn; khi quá tải trả kết quả cũ
+        # hoặc ước tính (shed_with_estimates), nếu không thì báo EngineOverloaded
+        self.admission = AdmissionController()
+        self.shed_with_estimates = True
+        
+        # Mọi request ra ngoài đi qua bộ lập lịch chung (xem fetch)
+        self.outbound = OutboundScheduler()
+        
+        # Chỉ mục khoảng giá cho validate_price: cache_key -> (min, max, đề xuất, có dữ liệu, thời điểm, degraded)
+        # Giữ theo thứ tự ghi, quá max_price_ranges thì bỏ mục cũ nhất
+        self.price_ranges = {}
+        self.max_price_ranges = 50000
+        self.degraded_range_ttl = 60  # Kết quả degraded chỉ giữ ngắn để lần sau scrape lại khi hết quá tải
+        self._range_fills = set()  # cache_key đang được tính nền
+        self._range_fill_lock = threading.Lock()
+        self._range_fill_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='range-fill')
+        
+        # Snapshot để khởi động lại với cache nóng (tắt khi snapshot_path là None)
+        self.snapshot_path = None
+        self.snapshot_interval = 300
+        self._snapshot_thread = None
+        self._snapshot_lock = threading.Lock()
+        
+        # Mẫu giá quá ít thì tải thêm trang kết quả của các nguồn cho nhiều listing nhất
+        self.min_sample_size = 8  # Dưới ngưỡng này bộ lọc IQR gần như vô nghĩa
+        self.max_extra_pages = 4  # Tổng số trang thêm cho mỗi lượt scrape
+        self.extra_page_sources = 2
+        self.extra_page_limit = 10
+        self.extra_page_budget = 5.0  # Giây; trang về muộn hơn bị bỏ qua
+        self._page_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='page-fetch')
+        
+        # Tầng chợ đồ cũ chạy song song với các cửa hàng chính hãng, giá được tính trọng số riêng
+        self.marketplace_weight = 0.5  # Tỷ trọng của giá đồ cũ trong giá đề xuất khi có cả hai tầng
+        self.marketplace_condition_baseline = 0.80  # Tin đăng đồ cũ trung bình coi như tình trạng '99%'
+        self.marketplace_limit = 10
+        self.marketplace_timeout = 8  # Timeout mỗi request tới chợ
+        self.marketplace_budget = 10.0  # Giây chờ tối đa cho cả tầng chợ
+        self._marketplace_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='marketplace')
+        # Pool riêng cho race_urls để tầng chợ không tranh luồng với trang kết quả thêm (_page_pool)
+        # Cỡ 12 = 4 scrape đồng thời (MAX_CONCURRENT_SCRAPES mặc định) x 3 search_urls của MuaBan:
+        # mọi URL của một lượt đua đều chạy ngay, nếu không URL chậm xếp trước sẽ chặn URL nhanh
+        self._race_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix='url-race')
+        
+        # Tên sản phẩm mơ hồ (điểm hai danh mục đầu gần nhau): scrape song song cả hai, giữ danh mục khớp hơn
+        self.category_ambiguity_ratio = 0.75  # Danh mục thứ hai đạt >= 75% điểm danh mục đầu thì coi là mơ hồ
+        self.max_fanout_categories = 2
+        self.category_fanout_budget = 20.0
+        self._category_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='category-fanout')
+        
+        # Bảng giá tham khảo cho ước tính dự phòng, tự nạp lại khi file thay đổi
+        self.reference_prices_path = os.environ.get(
+            'REFERENCE_PRICES_PATH',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'reference_prices.json')
+        )
+        self.reference_prices = ReferencePriceTable(
+            self.reference_prices_path, self.reference_tokens
+        )
+    
+    def _build_query_alias_index(self):
+        """Chuẩn hóa bảng alias và màu sắc (gọi lại sau khi thay đổi cấu hình)"""
+        self._alias_index = {
+            self.normalize_text(alias): self.normalize_text(target).split()
+            for alias, target in self.query_aliases.items()
+        }
+        self._alias_targets = {self.normalize_text(alias): target for alias, target in self.query_aliases.items()}
+        self._color_index = {self.normalize_text(color) for color in self.color_tokens}
+    
+    def _build_category_index(self):
+        """Chuẩn hóa keyword phân loại như tên sản phẩm (gọi lại sau khi sửa category_keywords)"""
+        categories_by_keyword = {}
+        for category, keywords in self.category_keywords.items():
+            for keyword in keywords:
+                categories_by_keyword.setdefault(self.fold_text(keyword), []).append(category)
+        self._category_index = [
+            (f" {keyword} ", category, 1 / len(categories))
+            for keyword, categories in categories_by_keyword.items() for category in categories
+        ]
+    
+    def expand_query(self, product_name: str) -> str:
+        """Thay alias bằng tên đầy đủ, giữ nguyên thứ tự từ của người dùng ("IP 13" -> "iphone 13"); dùng để scrape"""
+        words = []
+        for token in product_name.split():
+            parts = re.findall(r'[^\W\d_]+|\d+', self.normalize_text(token))
+            if any(part in self._alias_targets for part in parts):
+                words.extend(self._alias_targets.get(part, part) for part in parts)
+            else:
+                words.append(token)
+        return ' '.join(words)
+    
+    def canonicalize_query(self, product_name: str) -> str:
+        """Đưa các cách viết gần giống nhau của một sản phẩm về cùng một khóa"""
+        tokens = set()
+        for token in self.normalize_text(product_name).split():
+            if self.strip_storage_tokens and self.storage_token_pattern.match(token):
+                continue
+            
+            # Tách chữ và số: "iphone13" -> "iphone", "13"
+            for part in re.findall(r'[^\W\d_]+|\d+', token):
+                for word in self._alias_index.get(part, [part]):
+                    if self.strip_color_tokens and word in self._color_index:
+                        continue
+                    tokens.add(word)
+        
+        return ' '.join(sorted(tokens))
     
     def normalize_text(self, text: str) -> str:
         """Chuẩn hóa text để so sánh"""
@@ -229,29 +1653,42 @@ class PriceSuggestionEngine:
         
         return text
     
-    def detect_product_category(self, product_name: str) -> str:
-        """Tự động phát hiện danh mục sản phẩm dựa trên tên"""
-        normalized_name = self.normalize_text(product_name)
+    def fold_text(self, text: str) -> str:
+        """normalize_text và gộp 'đ' thành 'd', cho các phép so khớp mà người dùng hay gõ không dấu"""
+        return self.normalize_text(text).replace('đ', 'd')
+    
+    def reference_tokens(self, product_name: str) -> List[str]:
+        """Từ dùng để tra bảng giá tham khảo, cho cả tên model trong file lẫn truy vấn
         
-        # Đếm số keywords khớp cho mỗi category
-        category_scores = {}
-        for category, keywords in self.category_keywords.items():
-            score = 0
-            for keyword in keywords:
-                if keyword in normalized_name:
-                    score += 1
-            category_scores[category] = score
+        Gộp 'đ' thành 'd' (NFD không tách được 'đ'), để "Đồng hồ" khớp với khóa "dong ho"
+        """
+        return self.canonicalize_query(product_name).replace('đ', 'd').split()
+    
+    def score_product_categories(self, product_name: str) -> List[tuple]:
+        """Điểm của các danh mục khớp với tên sản phẩm, cao nhất trước; [('electronics', 0.0)] nếu không khớp gì"""
+        padded_name = f" {self.fold_text(product_name)} "
         
-        # Trả về category có điểm cao nhất
-        if category_scores:
-            best_category = max(category_scores, key=category_scores.get)
-            if category_scores[best_category] > 0:
-                logger.info(f"Detected category: {best_category} for product: {product_name}")
-                return best_category
+        category_scores = {}
+        for keyword, category, weight in self._category_index:
+            if keyword in padded_name:
+                category_scores[category] = category_scores.get(category, 0) + weight
         
-        # Mặc định là electronics nếu không xác định được
-        logger.info(f"Default category: electronics for product: {product_name}")
-        return 'electronics'
+        if not category_scores:
+            return [('electronics', 0.0)]
+        return sorted(category_scores.items(), key=lambda item: item[1], reverse=True)
+    
+    def ambiguous_categories(self, candidates: List[tuple]) -> List[str]:
+        """Các danh mục cần scrape: chỉ danh mục đầu, hoặc thêm các danh mục có điểm gần bằng"""
+        top_category, top_score = candidates[0]
+        close = [category for category, score in candidates[1:self.max_fanout_categories]
+                 if score > 0 and score >= top_score * self.category_ambiguity_ratio]
+        return [top_category] + close
+    
+    def detect_product_category(self, product_name: str) -> str:
+        """Tự động phát hiện danh mục sản phẩm dựa trên tên"""
+        category, score = self.score_product_categories(product_name)[0]
+        logger.debug("Detected category: %s (score %s) for product: %s", category, score, product_name)
+        return category
     
     def scrape_official_store(self, source_config: dict, product_name: str, limit: int = 5) -> List[Dict]:
         """Thu thập dữ liệu từ cửa hàng chính hãng"""
@@ -260,10 +1697,9 @@ class PriceSuggestionEngine:
         
         try:
             search_url = source_config['search_url'].format(query=quote(product_name))
-            logger.info(f"Scraping {source_name}: {search_url}")
+            logger.debug("Scraping %s: %s", source_name, search_url)
             
-            response = requests.get(search_url, headers=self.headers, timeout=15)
-            response.raise_for_status()
+            response = self.fetch(search_url, source_name)
             
             soup = BeautifulSoup(response.content, 'html.parser')
             normalized_query = self.normalize_text(product_name)
@@ -277,27 +1713,21 @@ class PriceSuggestionEngine:
                     price = self.extract_product_price(container, source_config, source_name)
                     
                     if title and price and self.is_similar_product(normalized_query, self.normalize_text(title)):
-                        results.append({
-                            'title': title,
-                            'price': price,
-                            'source': source_name,
-                            'url': search_url,
-                            'type': 'official_store'
-                        })
+                        results.append(Listing(title, price, source_name, search_url, 'official_store'))
                         
                         if len(results) >= limit:
                             break
                             
                 except Exception as e:
-                    logger.warning(f"Error parsing item from {source_name}: {e}")
+                    logger.warning("Error parsing item from %s: %s", source_name, e, extra=LOG_SAMPLED)
                     continue
             
-            logger.info(f"Found {len(results)} items from {source_name}")
+            logger.info("Found %s items from %s", len(results), source_name)
             
         except requests.RequestException as e:
-            logger.warning(f"Request failed for {source_name}: {e}")
+            logger.warning("Request failed for %s: %s", source_name, e)
         except Exception as e:
-            logger.error(f"Error scraping {source_name}: {e}")
+            logger.error("Error scraping %s: %s", source_name, e)
         
         return results
     
@@ -509,15 +1939,64 @@ class PriceSuggestionEngine:
         
         return None
     
-    def scrape_official_store(self, store_config: Dict, query: str, limit: int = 10) -> List[Dict]:
-        """Thu thập dữ liệu từ cửa hàng chính hãng"""
+    def fetch(self, url: str, source: Optional[str] = None, headers: Optional[Dict] = None,
+              timeout: float = 15) -> requests.Response:
+        """GET qua bộ lập lịch outbound theo lớp ưu tiên hiện tại; lỗi HTTP được raise như raise_for_status"""
+        source = source or urllib.parse.urlsplit(url).hostname
+        with self.outbound.slot(urllib.parse.urlsplit(url).hostname, _fetch_priority.get()) as waited:
+            record_timing('outbound_queue', waited, source)
+            fetch_started = time.perf_counter()
+            response = requests.get(url, headers=headers or self.headers, timeout=timeout)
+            fetch_time = time.perf_counter() - fetch_started
+        
+        SOURCE_FETCH_LATENCY.observe(fetch_time, source)
+        # elapsed: gửi request tới khi nhận xong header (gồm DNS, kết nối, TLS)
+        record_timing('connect_wait', response.elapsed.total_seconds(), source)
+        record_timing('download', max(fetch_time - response.elapsed.total_seconds(), 0), source)
+        response.raise_for_status()
+        return response
+    
+    def search_page_url(self, store_config: Dict, encoded_query: str, page: int = 1) -> str:
+        """URL trang kết quả thứ `page`: trang 1 là search_url (hoặc api_url), các trang sau theo page_url"""
+        if page > 1:
+            offset = (page - 1) * store_config.get('page_size', 20)
+            return store_config['page_url'].format(query=encoded_query, page=page, offset=offset)
+        if store_config.get('fetch_mode') == 'json':
+            return store_config['api_url'].format(query=encoded_query)
+        return store_config['search_url'].format(query=encoded_query)
+    
+    def scrape_official_store(self, store_config: Dict, query: str, limit: int = 10, page: int = 1) -> List[Dict]:
+        """Thu thập dữ liệu từ cửa hàng chính hãng (page > 1: trang kết quả tiếp theo theo page_url)"""
         results = []
+        source_name = store_config['name']
+        soup = None
+        SCRAPES_IN_FLIGHT.inc(source_name)
         try:
             # Chuẩn hóa query cho URL
             encoded_query = urllib.parse.quote_plus(query)
-            search_url = store_config['search_url'].format(query=encoded_query)
             
-            logger.info(f"Searching {store_config['name']} with URL: {search_url}")
+            if store_config.get('fetch_mode') == 'json':
+                # API tìm kiếm JSON: không tải trang HTML, không dựng DOM
+                api_url = self.search_page_url(store_config, encoded_query, page)
+                logger.debug("Searching %s with API: %s", source_name, api_url)
+                response = self.fetch(api_url, source_name, headers=self.json_headers, timeout=10)
+                
+                parse_started = time.perf_counter()
+                payload = response.json()
+                extract_started = time.perf_counter()
+                record_timing('parse', extract_started - parse_started, source_name)
+                results = self.parse_json_listings(payload, store_config, query, limit)
+                
+                record_timing('extract', time.perf_counter() - extract_started, source_name)
+                SOURCE_PARSE_LATENCY.observe(time.perf_counter() - parse_started, source_name)
+                SOURCE_REQUESTS.inc(source_name, 'success')
+                SOURCE_LISTINGS.inc(source_name, amount=len(results[:limit]))
+                logger.info("Successfully fetched %s items from %s API", len(results), source_name)
+                return results[:limit]
+            
+            search_url = self.search_page_url(store_config, encoded_query, page)
+            
+            logger.debug("Searching %s with URL: %s", store_config['name'], search_url)
             
             # Gửi request với headers giả lập browser
             headers = {
@@ -530,11 +2009,13 @@ class PriceSuggestionEngine:
                 'Upgrade-Insecure-Requests': '1',
             }
             
-            response = requests.get(search_url, headers=headers, timeout=10)
-            response.raise_for_status()
+            response = self.fetch(search_url, source_name, headers=headers, timeout=10)
             response.encoding = 'utf-8'
             
+            parse_started = time.perf_counter()
             soup = BeautifulSoup(response.content, 'html.parser')
+            extract_started = time.perf_counter()
+            record_timing('parse', extract_started - parse_started, source_name)
             
             # Parse dữ liệu theo cấu hình của từng store
             if store_config['name'] == 'Phong Vũ':
@@ -571,12 +2052,25 @@ class PriceSuggestionEngine:
                 # Generic parser cho các store khác
                 results = self.parse_generic_store(soup, query, limit)
             
-            logger.info(f"Successfully scraped {len(results)} items from {store_config['name']}")
+            record_timing('extract', time.perf_counter() - extract_started, source_name)
+            SOURCE_PARSE_LATENCY.observe(time.perf_counter() - parse_started, source_name)
+            SOURCE_REQUESTS.inc(source_name, 'success')
+            SOURCE_LISTINGS.inc(source_name, amount=len(results[:limit]))
+            logger.info("Successfully scraped %s items from %s", len(results), store_config['name'])
             
+        except requests.Timeout as e:
+            SOURCE_REQUESTS.inc(source_name, 'timeout')
+            logger.warning("Request timeout for %s: %s", store_config['name'], e)
         except requests.RequestException as e:
-            logger.warning(f"Request error for {store_config['name']}: {e}")
+            SOURCE_REQUESTS.inc(source_name, 'error')
+            logger.warning("Request error for %s: %s", store_config['name'], e)
         except Exception as e:
-            logger.error(f"Error scraping {store_config['name']}: {e}")
+            SOURCE_REQUESTS.inc(source_name, 'error')
+            logger.error("Error scraping %s: %s", store_config['name'], e)
+        finally:
+            SCRAPES_IN_FLIGHT.dec(source_name)
+            if soup is not None:
+                soup.decompose()  # Giải phóng cây DOM ngay, không chờ GC
         
         return results[:limit]
     
@@ -612,17 +2106,12 @@ class PriceSuggestionEngine:
                             if url.startswith('/'):
                                 url = f"https://phongvu.vn{url}"
                             
-                            results.append({
-                                'title': title,
-                                'price': price,
-                                'source': 'Phong Vũ',
-                                'url': url
-                            })
+                            results.append(Listing(title, price, 'Phong Vũ', url))
                 except Exception as e:
                     continue
                     
         except Exception as e:
-            logger.warning(f"Error parsing Phong Vũ data: {e}")
+            logger.warning("Error parsing Phong Vũ data: %s", e, extra=LOG_SAMPLED)
         
         return results
     
@@ -651,17 +2140,12 @@ class PriceSuggestionEngine:
                             if url.startswith('/'):
                                 url = f"https://cellphones.com.vn{url}"
                             
-                            results.append({
-                                'title': title,
-                                'price': price,
-                                'source': 'CellphoneS',
-                                'url': url
-                            })
+                            results.append(Listing(title, price, 'CellphoneS', url))
                 except Exception:
                     continue
                     
         except Exception as e:
-            logger.warning(f"Error parsing CellphoneS data: {e}")
+            logger.warning("Error parsing CellphoneS data: %s", e, extra=LOG_SAMPLED)
         
         return results
     
@@ -687,28 +2171,57 @@ class PriceSuggestionEngine:
                             if url.startswith('/'):
                                 url = f"https://thegioididong.com{url}"
                             
-                            results.append({
-                                'title': title,
-                                'price': price,
-                                'source': 'Thế Giới Di Động',
-                                'url': url
-                            })
+                            results.append(Listing(title, price, 'Thế Giới Di Động', url))
                 except Exception:
                     continue
                     
         except Exception as e:
-            logger.warning(f"Error parsing TGDĐ data: {e}")
+            logger.warning("Error parsing TGDĐ data: %s", e, extra=LOG_SAMPLED)
         
         return results
     
-    def parse_generic_store(self, soup: BeautifulSoup, query: str, limit: int) -> List[Dict]:
-        """Generic parser cho các store chưa có parser riêng"""
+    def parse_json_listings(self, payload: Dict, store_config: Dict, query: str, limit: int) -> List[Dict]:
+        """Lấy listing từ kết quả API tìm kiếm theo json_fields của nguồn"""
+        fields = store_config['json_fields']
+        source_name = store_config['name']
         results = []
-        try:
-            # Tìm các element có thể chứa sản phẩm
-            product_selectors = [
-                'div[class*="product"]',
-                'li[class*="item"]', 
+        
+        for entry in get_json_path(payload, fields['items']) or []:
+            if len(results) >= limit:
+                break
+            try:
+                item = get_json_path(entry, fields['item']) if fields.get('item') else entry
+                title = get_json_path(item, fields['title'])
+                value = get_json_path(item, fields['price'])
+                if not title or value is None:
+                    continue
+                
+                if isinstance(value, str):
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        value = self.extract_price(value)
+                price = int(value / fields.get('price_divisor', 1))
+                
+                if price > 0 and self.is_relevant_product(title, query):
+                    try:
+                        url = fields['url'].format(**item)
+                    except (KeyError, IndexError, ValueError):
+                        url = store_config.get('base_url', '#')
+                    results.append(Listing(title, price, source_name, url))
+            except Exception as e:
+                logger.warning("Error parsing %s API item: %s", source_name, e, extra=LOG_SAMPLED)
+        
+        return results
+    
+    def parse_generic_store(self, soup: BeautifulSoup, query: str, limit: int) -> List[Dict]:
+        """Generic parser cho các store chưa có parser riêng"""
+        results = []
+        try:
+            # Tìm các element có thể chứa sản phẩm
+            product_selectors = [
+                'div[class*="product"]',
+                'li[class*="item"]', 
                 'div[class*="item"]',
                 '.product-item',
                 '.search-result'
@@ -741,18 +2254,13 @@ class PriceSuggestionEngine:
                                 link_element = item.find('a', href=True)
                                 url = link_element['href'] if link_element else "#"
                                 
-                                results.append({
-                                    'title': title,
-                                    'price': price,
-                                    'source': 'Generic Store',
-                                    'url': url
-                                })
+                                results.append(Listing(title, price, 'Generic Store', url))
                         except Exception:
                             continue
                     break  # Dừng khi tìm thấy dữ liệu
                     
         except Exception as e:
-            logger.warning(f"Error in generic parser: {e}")
+            logger.warning("Error in generic parser: %s", e, extra=LOG_SAMPLED)
         
         return results
     
@@ -805,15 +2313,19 @@ class PriceSuggestionEngine:
         return self.parse_generic_store(soup, query, limit)
     
     def scrape_chotot_web(self, product_name: str, limit: int = 10) -> List[Dict]:
-        """Fallback scraping từ website Chợ Tốt"""
+        """Lấy tin Chợ Tốt: qua API JSON nếu được cấu hình, nếu không thì scrape website"""
+        chotot_config = self.marketplace_sources['chotot']
+        if chotot_config.get('fetch_mode') == 'json':
+            return self.scrape_official_store(dict(chotot_config, name='chotot.com'), product_name, limit)
+        
         results = []
+        soup = None
         try:
-            search_url = f"https://www.chotot.com/tp-ho-chi-minh/mua-ban-dien-tu?q={quote(product_name)}"
+            search_url = chotot_config['search_url'].format(query=quote(product_name))
             
-            logger.info(f"Fallback scraping Chotot web: {search_url}")
+            logger.info("Fallback scraping Chotot web: %s", search_url)
             
-            response = requests.get(search_url, headers=self.headers, timeout=15)
-            response.raise_for_status()
+            response = self.fetch(search_url, 'chotot.com')
             
             soup = BeautifulSoup(response.content, 'html.parser')
             
@@ -849,131 +2361,148 @@ class PriceSuggestionEngine:
                                 price = self.extract_price_from_text(price_text)
                                 
                                 if price and len(results) < limit:
-                                    results.append({
-                                        'title': title,
-                                        'price': price,
-                                        'source': 'chotot.com',
-                                        'url': search_url
-                                    })
+                                    results.append(Listing(title, price, 'chotot.com', search_url))
                 
                 except Exception as e:
-                    logger.warning(f"Error parsing Chotot web item: {e}")
+                    logger.warning("Error parsing Chotot web item: %s", e, extra=LOG_SAMPLED)
                     continue
             
         except Exception as e:
-            logger.error(f"Error scraping Chotot web: {e}")
+            logger.error("Error scraping Chotot web: %s", e)
+        finally:
+            if soup is not None:
+                soup.decompose()
         
         return results
     
     def scrape_muaban(self, product_name: str, limit: int = 10) -> List[Dict]:
-        """Thu thập dữ liệu từ MuaBan.net với selectors cập nhật"""
+        """Thu thập dữ liệu từ MuaBan.net: chạy đua các URL pattern, URL đầu tiên có kết quả thắng"""
+        normalized_query = self.normalize_text(product_name)
+        urls_to_try = [
+            url.format(query=quote(product_name))
+            for url in self.marketplace_sources['muaban']['search_urls']
+        ]
+        return self.race_urls(
+            urls_to_try, lambda url, cancelled: self.scrape_muaban_url(url, normalized_query, limit, cancelled)
+        )
+    
+    def scrape_muaban_url(self, search_url: str, normalized_query: str, limit: int,
+                          cancelled: Optional[threading.Event] = None) -> List[Dict]:
+        """Scrape một URL tìm kiếm của MuaBan.net; dừng sớm nếu `cancelled` đã được đặt"""
         results = []
+        soup = None
         try:
-            normalized_query = self.normalize_text(product_name)
+            if cancelled is not None and cancelled.is_set():
+                return results
+            logger.debug("Trying MuaBan URL: %s", search_url)
             
-            # Thử nhiều URL patterns
-            urls_to_try = [
-                f"https://muaban.net/tim-kiem?q={quote(product_name)}",
-                f"https://muaban.net/search?keyword={quote(product_name)}",
-                f"https://www.muaban.net/tim-kiem/{quote(product_name)}"
+            response = self.fetch(search_url, 'muaban.net', timeout=self.marketplace_timeout)
+            if cancelled is not None and cancelled.is_set():
+                return results  # URL khác đã thắng: bỏ qua bước parse
+            
+            soup = BeautifulSoup(response.content, 'html.parser')
+            
+            # Thử nhiều selectors khác nhau
+            selectors = [
+                {'tag': ['div', 'li'], 'class': lambda x: x and any(term in x.lower() for term in ['product', 'item', 'listing', 'ad'])},
+                {'tag': ['article'], 'class': lambda x: x and 'item' in x.lower()},
+                {'tag': ['div'], 'attrs': {'data-test': lambda x: x and 'item' in x}},
             ]
             
-            for search_url in urls_to_try:
-                try:
-                    logger.info(f"Trying MuaBan URL: {search_url}")
-                    
-                    response = requests.get(search_url, headers=self.headers, timeout=15)
-                    response.raise_for_status()
-                    
-                    soup = BeautifulSoup(response.content, 'html.parser')
+            product_items = []
+            for selector in selectors:
+                items = soup.find_all(selector['tag'], attrs=selector.get('attrs', {'class': selector['class']}))
+                if items:
+                    product_items = items
+                    break
+            
+            found_items = 0
+            for item in product_items:
+                if found_items >= limit:
+                    break
                     
-                    # Thử nhiều selectors khác nhau
-                    selectors = [
-                        {'tag': ['div', 'li'], 'class': lambda x: x and any(term in x.lower() for term in ['product', 'item', 'listing', 'ad'])},
-                        {'tag': ['article'], 'class': lambda x: x and 'item' in x.lower()},
-                        {'tag': ['div'], 'attrs': {'data-test': lambda x: x and 'item' in x}},
+                try:
+                    # Tìm tiêu đề với nhiều cách khác nhau
+                    title_elem = None
+                    title_selectors = [
+                        {'tag': ['h1', 'h2', 'h3', 'h4'], 'class': lambda x: x and any(term in x.lower() for term in ['title', 'name', 'subject'])},
+                        {'tag': ['a'], 'class': lambda x: x and 'title' in x.lower()},
+                        {'tag': ['span'], 'class': lambda x: x and 'title' in x.lower()},
+                        {'tag': ['a'], 'attrs': {'title': True}},
+                        {'tag': ['a'], 'attrs': {}}  # Any link
                     ]
                     
-                    product_items = []
-                    for selector in selectors:
-                        items = soup.find_all(selector['tag'], attrs=selector.get('attrs', {'class': selector['class']}))
-                        if items:
-                            product_items = items
+                    for title_sel in title_selectors:
+                        title_elem = item.find(title_sel['tag'], attrs=title_sel.get('attrs', {'class': title_sel['class']}))
+                        if title_elem:
                             break
                     
-                    found_items = 0
-                    for item in product_items:
-                        if found_items >= limit:
-                            break
-                            
-                        try:
-                            # Tìm tiêu đề với nhiều cách khác nhau
-                            title_elem = None
-                            title_selectors = [
-                                {'tag': ['h1', 'h2', 'h3', 'h4'], 'class': lambda x: x and any(term in x.lower() for term in ['title', 'name', 'subject'])},
-                                {'tag': ['a'], 'class': lambda x: x and 'title' in x.lower()},
-                                {'tag': ['span'], 'class': lambda x: x and 'title' in x.lower()},
-                                {'tag': ['a'], 'attrs': {'title': True}},
-                                {'tag': ['a'], 'attrs': {}}  # Any link
+                    if title_elem:
+                        title = title_elem.get_text(strip=True) or title_elem.get('title', '').strip()
+                        normalized_title = self.normalize_text(title)
+                        
+                        # Kiểm tra độ tương đồng
+                        if title and self.is_similar_product(normalized_query, normalized_title):
+                            # Tìm giá với nhiều cách
+                            price_elem = None
+                            price_selectors = [
+                                {'tag': ['span', 'div'], 'class': lambda x: x and 'price' in x.lower()},
+                                {'tag': ['span', 'div'], 'class': lambda x: x and 'gia' in x.lower()},
+                                {'tag': ['span'], 'attrs': {'data-price': True}},
+                                {'tag': ['div'], 'class': lambda x: x and 'money' in x.lower()}
                             ]
                             
-                            for title_sel in title_selectors:
-                                title_elem = item.find(title_sel['tag'], attrs=title_sel.get('attrs', {'class': title_sel['class']}))
-                                if title_elem:
+                            for price_sel in price_selectors:
+                                price_elem = item.find(price_sel['tag'], attrs=price_sel.get('attrs', {'class': price_sel['class']}))
+                                if price_elem:
                                     break
                             
-                            if title_elem:
-                                title = title_elem.get_text(strip=True) or title_elem.get('title', '').strip()
-                                normalized_title = self.normalize_text(title)
+                            if price_elem:
+                                price_text = price_elem.get_text(strip=True)
+                                price = self.extract_price_from_text(price_text)
                                 
-                                # Kiểm tra độ tương đồng
-                                if title and self.is_similar_product(normalized_query, normalized_title):
-                                    # Tìm giá với nhiều cách
-                                    price_elem = None
-                                    price_selectors = [
-                                        {'tag': ['span', 'div'], 'class': lambda x: x and 'price' in x.lower()},
-                                        {'tag': ['span', 'div'], 'class': lambda x: x and 'gia' in x.lower()},
-                                        {'tag': ['span'], 'attrs': {'data-price': True}},
-                                        {'tag': ['div'], 'class': lambda x: x and 'money' in x.lower()}
-                                    ]
-                                    
-                                    for price_sel in price_selectors:
-                                        price_elem = item.find(price_sel['tag'], attrs=price_sel.get('attrs', {'class': price_sel['class']}))
-                                        if price_elem:
-                                            break
-                                    
-                                    if price_elem:
-                                        price_text = price_elem.get_text(strip=True)
-                                        price = self.extract_price_from_text(price_text)
-                                        
-                                        if price:
-                                            results.append({
-                                                'title': title,
-                                                'price': price,
-                                                'source': 'muaban.net',
-                                                'url': search_url
-                                            })
-                                            found_items += 1
-                        
-                        except Exception as e:
-                            logger.warning(f"Error parsing MuaBan item: {e}")
-                            continue
-                    
-                    if results:
-                        break  # Nếu tìm thấy kết quả, dừng thử URL khác
-                        
-                except requests.RequestException as e:
-                    logger.warning(f"Request failed for {search_url}: {e}")
-                    continue
+                                if price:
+                                    results.append(Listing(title, price, 'muaban.net', search_url))
+                                    found_items += 1
+                
                 except Exception as e:
-                    logger.warning(f"Error with {search_url}: {e}")
+                    logger.warning("Error parsing MuaBan item: %s", e, extra=LOG_SAMPLED)
                     continue
             
+        except requests.RequestException as e:
+            logger.warning("Request failed for %s: %s", search_url, e)
         except Exception as e:
-            logger.error(f"Error scraping MuaBan: {e}")
+            logger.warning("Error with %s: %s", search_url, e)
+        finally:
+            if soup is not None:
+                soup.decompose()
         
         return results
     
+    def race_urls(self, urls: List[str], scrape_url) -> List[Dict]:
+        """Gửi song song tới mọi URL ứng viên: kết quả không rỗng đầu tiên thắng, các URL còn lại bị hủy
+        
+        URL chưa chạy bị hủy hẳn; URL đang tải bỏ qua bước parse khi thấy `cancelled`
+        """
+        cancelled = threading.Event()
+        futures = {
+            self._race_pool.submit(contextvars.copy_context().run, scrape_url, url, cancelled): url
+            for url in urls
+        }
+        try:
+            for future in as_completed(futures, timeout=self.marketplace_budget):
+                results = future.result()
+                if results:
+                    logger.debug("Won URL race: %s", futures[future])
+                    return results
+        except FuturesTimeoutError:
+            logger.info("No URL answered within %ss: %s", self.marketplace_budget, urls[0])
+        finally:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+        return []
+    
     def scrape_facebook_marketplace(self, product_name: str, limit: int = 5) -> List[Dict]:
         """Thu thập dữ liệu từ Facebook Marketplace (limited)"""
         results = []
@@ -1008,40 +2537,55 @@ class PriceSuggestionEngine:
                 # Tạo một vài giá mẫu trong khoảng
                 for i in range(min(3, limit)):
                     price = random.randint(found_range['min'], found_range['max'])
-                    results.append({
-                        'title': f"{product_name} - Sample from market research",
-                        'price': price,
-                        'source': 'facebook.com/marketplace',
-                        'url': 'https://facebook.com/marketplace'
-                    })
+                    results.append(Listing(
+                        title=f"{product_name} - Sample from market research",
+                        price=price,
+                        source='facebook.com/marketplace',
+                        url='https://facebook.com/marketplace'
+                    ))
             
         except Exception as e:
-            logger.warning(f"Error in Facebook Marketplace simulation: {e}")
+            logger.warning("Error in Facebook Marketplace simulation: %s", e)
         
         return results
     
     def is_similar_product(self, query: str, title: str, min_similarity: float = 0.3) -> bool:
         """Kiểm tra độ tương đồng giữa tên sản phẩm"""
+        return self.title_similarity(query, title) >= min_similarity
+    
+    def title_similarity(self, query: str, title: str) -> float:
+        """Jaccard similarity giữa tập từ của truy vấn và tiêu đề (đã chuẩn hóa)"""
         if not query or not title:
-            return False
+            return 0
         
         query_words = set(query.split())
         title_words = set(title.split())
         
         if not query_words or not title_words:
-            return False
+            return 0
         
         # Tính toán Jaccard similarity
         intersection = len(query_words.intersection(title_words))
         union = len(query_words.union(title_words))
         
-        similarity = intersection / union if union > 0 else 0
-        
-        return similarity >= min_similarity
+        return intersection / union if union > 0 else 0
     
-    def calculate_price_range(self, prices: List[int], condition: str) -> Dict:
-        """Tính toán khoảng giá hợp lý"""
-        if not prices:
+    def extract_price(self, text: str) -> int:
+        """Trích xuất giá cho các parser riêng của từng cửa hàng (0 nếu không có)"""
+        return self.extract_price_from_text(text) or 0
+    
+    def is_relevant_product(self, title: str, query: str) -> bool:
+        """Kiểm tra tiêu đề listing có khớp với truy vấn hay không"""
+        return self.is_similar_product(self.normalize_text(query), self.normalize_text(title))
+    
+    def calculate_price_range(self, prices: List[int], condition: str, marketplace_prices: Optional[List[int]] = None) -> Dict:
+        """Tính toán khoảng giá hợp lý
+        
+        prices là giá bán mới (nhân hệ số tình trạng); marketplace_prices là giá tin đăng đồ cũ, chỉ được
+        điều chỉnh theo độ chênh tình trạng so với marketplace_condition_baseline và trộn theo marketplace_weight
+        """
+        marketplace_prices = marketplace_prices or []
+        if not prices and not marketplace_prices:
             return {
                 'min_price': 0,
                 'max_price': 0,
@@ -1050,28 +2594,31 @@ class PriceSuggestionEngine:
                 'condition_multiplier': 1.0
             }
         
-        # Loại bỏ outliers (giá quá cao hoặc quá thấp)
-        sorted_prices = sorted(prices)
-        q1 = sorted_prices[len(sorted_prices)//4]
-        q3 = sorted_prices[3*len(sorted_prices)//4]
-        iqr = q3 - q1
-        
-        filtered_prices = [p for p in prices if q1 - 1.5*iqr <= p <= q3 + 1.5*iqr]
+        condition_multiplier = self.condition_multipliers.get(condition, 0.75)
         
-        if not filtered_prices:
-            filtered_prices = prices
+        # Loại bỏ outliers (giá quá cao hoặc quá thấp), riêng cho từng tầng
+        filtered_prices = self.remove_outliers(prices)
+        filtered_marketplace = self.remove_outliers(marketplace_prices)
         
-        market_average = statistics.mean(filtered_prices)
-        condition_multiplier = self.condition_multipliers.get(condition, 0.75)
+        market_average = statistics.mean(filtered_prices) if filtered_prices else 0
+        marketplace_average = statistics.mean(filtered_marketplace) if filtered_marketplace else 0
         
         # Tính giá đề xuất dựa trên tình trạng
-        recommended_price = market_average * condition_multiplier
+        retail_estimate = market_average * condition_multiplier
+        marketplace_estimate = marketplace_average * condition_multiplier / self.marketplace_condition_baseline
+        if not filtered_marketplace:
+            recommended_price = retail_estimate
+        elif not filtered_prices:
+            recommended_price = marketplace_estimate
+        else:
+            recommended_price = (retail_estimate * (1 - self.marketplace_weight)
+                                 + marketplace_estimate * self.marketplace_weight)
         
         # Khoảng giá hợp lý (±15% từ giá đề xuất)
         min_price = recommended_price * 0.85
         max_price = recommended_price * 1.15
         
-        return {
+        price_range = {
             'min_price': int(min_price),
             'max_price': int(max_price),
             'recommended_price': int(recommended_price),
@@ -1079,37 +2626,176 @@ class PriceSuggestionEngine:
             'condition_multiplier': condition_multiplier,
             'sample_size': len(filtered_prices)
         }
+        if marketplace_prices:
+            price_range['marketplace_average'] = int(marketplace_average)
+            price_range['marketplace_sample_size'] = len(filtered_marketplace)
+        return price_range
+    
+    def remove_outliers(self, prices: List[int]) -> List[int]:
+        """Bỏ giá nằm ngoài [Q1 - 1.5 IQR, Q3 + 1.5 IQR]"""
+        if not prices:
+            return []
+        sorted_prices = sorted(prices)
+        q1 = sorted_prices[len(sorted_prices)//4]
+        q3 = sorted_prices[3*len(sorted_prices)//4]
+        iqr = q3 - q1
+        
+        filtered_prices = [p for p in prices if q1 - 1.5*iqr <= p <= q3 + 1.5*iqr]
+        return filtered_prices or prices
     
     def get_price_suggestion(self, product_name: str, condition: str) -> Dict:
         """Lấy gợi ý giá cho sản phẩm từ các cửa hàng chính hãng theo danh mục"""
-        cache_key = f"{product_name}_{condition}"
+        canonical_query = self.canonicalize_query(product_name) or product_name
+        cache_key = f"{canonical_query}_{condition}"
+        self.query_popularity.add(cache_key)
         
         # Kiểm tra cache
         if cache_key in self.cache:
             cached_data = self.cache[cache_key]
             if datetime.now() - cached_data['timestamp'] < timedelta(seconds=self.cache_duration):
-                logger.info(f"Returning cached result for {cache_key}")
+                CACHE_LOOKUPS.inc('hit')
+                annotate_timing('cache', 'hit')
+                logger.info("Returning cached result for %s", cache_key)
                 return cached_data['data']
+            CACHE_LOOKUPS.inc('stale')
+            annotate_timing('cache', 'stale')
+        else:
+            CACHE_LOOKUPS.inc('miss')
+            annotate_timing('cache', 'miss')
+        
+        # Scrape bằng truy vấn đã mở rộng alias: kết quả được dùng chung cho mọi cách viết của cùng khóa
+        return self.compute_price_suggestion(self.expand_query(product_name), condition, canonical_query, cache_key)
+    
+    def compute_price_suggestion(self, product_name: str, condition: str, canonical_query: str, cache_key: str,
+                                 use_corpus: bool = True, degrade: bool = True) -> Dict:
+        """Scrape và tính gợi ý giá, bỏ qua cache (dùng cho cả làm mới nền)
+        
+        Khi quá tải và degrade=True: trả kết quả cũ trong cache hoặc giá ước tính, có trường 'degraded'
+        """
+        logger.info("Getting price suggestion for: %s - %s", product_name, condition)
+        degraded = None
+        
+        # 1. Tự động phát hiện danh mục sản phẩm (tên mơ hồ: nhiều danh mục ứng viên)
+        with timed_phase('category_detection'):
+            candidates = self.score_product_categories(product_name)
+            categories = self.ambiguous_categories(candidates)
+        category = categories[0]
+        category_info = self.data_sources.get(category, self.data_sources['electronics'])
         
-        logger.info(f"Getting price suggestion for: {product_name} - {condition}")
+        logger.info("Product category detected: %s (%s)", category, category_info['name'])
+        
+        # 2. Dùng lại listing đã scrape gần đây nếu đủ, nếu không thì scrape các cửa hàng
+        with timed_phase('corpus_lookup'):
+            corpus_data = self.filter_reasonable_prices(
+                self.listing_corpus.search(self.normalize_text(product_name), self.is_similar_product),
+                category
+            )
+        if use_corpus and len(corpus_data) >= self.corpus_min_listings:
+            logger.info("Answering %s from %s corpus listings", product_name, len(corpus_data))
+            sources = [item for item in corpus_data if item['type'] != 'marketplace']
+            marketplace_data = [item for item in corpus_data if item['type'] == 'marketplace']
+            all_prices = [item['price'] for item in sources]
+            data_sources_used = list(dict.fromkeys(item['source'] for item in corpus_data))
+        else:
+            marketplace_data = []
+            try:
+                with self.admission.slot(_fetch_priority.get()):
+                    with timed_phase('scrape'):
+                        # Tầng chợ đồ cũ chạy nền trong lúc duyệt các cửa hàng chính hãng
+                        marketplaces = self.start_marketplace_scrapes(product_name, categories)
+                        if len(categories) > 1:
+                            category, (all_prices, sources, data_sources_used) = self.scrape_candidate_categories(
+                                categories, product_name
+                            )
+                            category_info = self.data_sources.get(category, self.data_sources['electronics'])
+                        else:
+                            all_prices, sources, data_sources_used = self.scrape_category_sources(category_info, product_name, category)
+                    with timed_phase('marketplaces'):
+                        marketplace_data = self.collect_marketplace_scrapes(marketplaces, category)
+                    data_sources_used.extend(dict.fromkeys(item['source'] for item in marketplace_data))
+            except EngineOverloaded:
+                if not degrade:
+                    raise
+                stale = self.cache.get(cache_key)
+                if stale:
+                    ADMISSION_SHED.inc('stale')
+                    annotate_timing('degraded', 'stale')
+                    logger.warning("Overloaded, serving stale result for %s", cache_key)
+                    return dict(stale['data'], degraded='stale')
+                if not self.shed_with_estimates:
+                    ADMISSION_SHED.inc('rejected')
+                    raise
+                ADMISSION_SHED.inc('estimated')
+                annotate_timing('degraded', 'estimated')
+                logger.warning("Overloaded, answering %s from estimates", cache_key)
+                degraded = 'estimated'
+                all_prices, sources, data_sources_used = [], [], []
+            if all_prices:
+                self.price_history.record(canonical_query, all_prices)
         
-        # 1. Tự động phát hiện danh mục sản phẩm
-        category = self.detect_product_category(product_name)
-        category_info = self.data_sources.get(category, self.data_sources['electronics'])
+        # 3. Nếu không có dữ liệu thực, tạo dữ liệu ước tính dựa trên danh mục
+        marketplace_prices = [item['price'] for item in marketplace_data]
+        if not all_prices and not marketplace_prices:
+            logger.info("No real data found, generating estimated prices based on category...")
+            with timed_phase('estimate'):
+                estimated_data = self.generate_category_based_estimates(product_name, category, condition)
+            all_prices.extend([item['price'] for item in estimated_data])
+            sources.extend(estimated_data)
+            data_sources_used.append('Estimated Data')
+        
+        # 4. Tính toán khoảng giá
+        with timed_phase('aggregate'):
+            price_range = self.calculate_price_range(all_prices, condition, marketplace_prices)
         
+        result = {
+            'product_name': product_name,
+            'canonical_query': canonical_query,
+            'condition': condition,
+            'category': category,
+            'category_name': category_info['name'],
+            'price_range': price_range,
+            'sources': [item.to_dict() for item in sources[:15] + marketplace_data[:10]],  # Tối đa 15 + 10 tin đồ cũ
+            'timestamp': datetime.now().isoformat(),
+            'success': len(all_prices) + len(marketplace_prices) > 0,
+            'data_sources_used': data_sources_used
+        }
+        if len(categories) > 1:
+            result['category_candidates'] = [{'category': name, 'score': round(score, 3)}
+                                             for name, score in candidates if name in categories]
+        
+        if degraded:
+            # Không lưu cache để request sau được scrape khi hết quá tải
+            result['degraded'] = degraded
+            return result
+        
+        # Lưu cache
+        self.cache[cache_key] = {
+            'data': result,
+            'timestamp': datetime.now(),
+            'product_name': product_name,
+            'canonical_query': canonical_query,
+            'condition': condition
+        }
+        self.store_price_range(cache_key, price_range, result['success'])
+        
+        logger.info("Generated price suggestion with %s + %s marketplace price points from %s sources",
+                    len(all_prices), len(marketplace_prices), len(data_sources_used))
+        
+        return result
+    
+    def scrape_category_sources(self, category_info: Dict, product_name: str, category: str) -> tuple:
+        """Thu thập dữ liệu từ các cửa hàng chính hãng theo danh mục"""
         all_prices = []
         sources = []
         data_sources_used = []
+        source_counts = []  # (source_config, số listing hợp lệ ở trang đầu)
         
-        logger.info(f"Product category detected: {category} ({category_info['name']})")
-        
-        # 2. Thu thập dữ liệu từ các cửa hàng chính hãng theo danh mục
         for source_config in category_info['sources']:
             if not source_config.get('active', False):
                 continue
                 
             try:
-                logger.info(f"Scraping {source_config['name']}...")
+                logger.debug("Scraping %s...", source_config['name'])
                 source_data = self.scrape_official_store(source_config, product_name, limit=5)
                 
                 if source_data:
@@ -1119,47 +2805,417 @@ class PriceSuggestionEngine:
                     all_prices.extend([item['price'] for item in filtered_data])
                     sources.extend(filtered_data)
                     data_sources_used.append(source_config['name'])
+                    source_counts.append((source_config, len(filtered_data)))
+                    self.listing_corpus.add(filtered_data, self.normalize_text)
                     
-                    logger.info(f"Found {len(filtered_data)} valid items from {source_config['name']}")
+                    logger.info("Found %s valid items from %s", len(filtered_data), source_config['name'])
                 
-                time.sleep(1)  # Delay để tránh bị block
+                with timed_phase('politeness_delay'):
+                    time.sleep(self.request_delay)  # Delay để tránh bị block
                 
             except Exception as e:
-                logger.warning(f"Error scraping {source_config['name']}: {e}")
+                logger.warning("Error scraping %s: %s", source_config['name'], e)
                 continue
         
-        # 3. Nếu không có dữ liệu thực, tạo dữ liệu ước tính dựa trên danh mục
-        if not all_prices:
-            logger.info("No real data found, generating estimated prices based on category...")
-            estimated_data = self.generate_category_based_estimates(product_name, category, condition)
-            all_prices.extend([item['price'] for item in estimated_data])
-            sources.extend(estimated_data)
-            data_sources_used.append('Estimated Data')
+        if len(all_prices) < self.min_sample_size and source_counts:
+            with timed_phase('extra_pages'):
+                extra_data = self.scrape_extra_pages(source_counts, product_name, category, sources)
+            if extra_data:
+                all_prices.extend([item['price'] for item in extra_data])
+                sources.extend(extra_data)
+                self.listing_corpus.add(extra_data, self.normalize_text)
         
-        # 4. Tính toán khoảng giá
-        price_range = self.calculate_price_range(all_prices, condition)
+        return all_prices, sources, data_sources_used
+    
+    def scrape_candidate_categories(self, categories: List[str], product_name: str) -> tuple:
+        """Scrape song song nguồn của các danh mục ứng viên, giữ danh mục có listing khớp truy vấn nhất
         
-        result = {
+        Trả về (category, (all_prices, sources, data_sources_used)); danh mục về muộn hơn category_fanout_budget bị bỏ qua
+        """
+        normalized_query = self.normalize_text(product_name)
+        futures = {
+            self._category_pool.submit(
+                contextvars.copy_context().run, self.scrape_category_sources,
+                self.data_sources.get(category, self.data_sources['electronics']), product_name, category
+            ): category
+            for category in categories
+        }
+        
+        # Điểm khớp: tổng độ tương đồng tiêu đề, nên vừa tính số listing vừa tính độ sát nghĩa
+        scored = {}
+        try:
+            for future in as_completed(futures, timeout=self.category_fanout_budget):
+                category = futures[future]
+                try:
+                    scraped = future.result()
+                except Exception as e:
+                    logger.warning("Error scraping category %s: %s", category, e)
+                    continue
+                match = sum(self.title_similarity(normalized_query, self.normalize_text(item['title'])) for item in scraped[1])
+                scored[category] = (match, scraped)
+        except FuturesTimeoutError:
+            logger.info("Category fan-out for %s exceeded %ss budget", product_name, self.category_fanout_budget)
+        
+        if not scored:
+            return categories[0], ([], [], [])
+        # Hòa điểm thì giữ thứ tự của bộ phân loại
+        best = max(scored, key=lambda category: (scored[category][0], -categories.index(category)))
+        annotate_timing('category_fanout', {category: round(match, 3) for category, (match, _) in scored.items()})
+        logger.info("Ambiguous category for %s: kept %s out of %s", product_name, best, categories)
+        return best, scored[best][1]
+    
+    def scrape_extra_pages(self, source_counts: List[tuple], product_name: str, category: str,
+                           existing: List[Dict]) -> List[Dict]:
+        """Tải song song các trang kết quả tiếp theo của những nguồn cho nhiều listing nhất
+        
+        Dừng khi đủ min_sample_size, hết max_extra_pages trang hoặc quá extra_page_budget giây
+        """
+        productive = [config for config, count in sorted(source_counts, key=lambda item: item[1], reverse=True)
+                      if count and config.get('page_url')][:self.extra_page_sources]
+        # Trang 2 của mọi nguồn trước, rồi mới tới trang 3...
+        jobs = [(config, page) for page in range(2, self.max_extra_pages + 2) for config in productive]
+        jobs = jobs[:self.max_extra_pages]
+        if not jobs:
+            return []
+        
+        needed = self.min_sample_size - len(existing)
+        seen = {(item['source'], item['title'], item['price']) for item in existing}
+        results = []
+        futures = [
+            self._page_pool.submit(contextvars.copy_context().run, self.scrape_official_store,
+                                   config, product_name, self.extra_page_limit, page)
+            for config, page in jobs
+        ]
+        try:
+            for future in as_completed(futures, timeout=self.extra_page_budget):
+                for item in self.filter_reasonable_prices(future.result(), category):
+                    key = (item['source'], item['title'], item['price'])
+                    if key not in seen:
+                        seen.add(key)
+                        results.append(item)
+                if len(results) >= needed:
+                    break
+        except FuturesTimeoutError:
+            logger.info("Extra pages for %s exceeded %ss budget", product_name, self.extra_page_budget)
+        finally:
+            for future in futures:
+                future.cancel()
+        
+        annotate_timing('extra_pages', len(jobs))
+        logger.info("Fetched %s extra listings for %s from %s pages", len(results), product_name, len(jobs))
+        return results
+    
+    def start_marketplace_scrapes(self, product_name: str, categories: List[str]) -> tuple:
+        """Bắt đầu scrape các chợ đồ cũ của các danh mục ứng viên ở luồng nền; kết quả lấy bằng collect_marketplace_scrapes"""
+        scrapers = {'chotot': self.scrape_chotot_web, 'muaban': self.scrape_muaban}
+        futures = {}
+        for name, scraper in scrapers.items():
+            config = self.marketplace_sources.get(name)
+            if not config or not config.get('active', True):
+                continue
+            if config.get('categories') is not None and not set(categories) & set(config['categories']):
+                continue
+            future = self._marketplace_pool.submit(contextvars.copy_context().run, scraper, product_name, self.marketplace_limit)
+            futures[future] = name
+        return futures, time.monotonic() + self.marketplace_budget
+    
+    def collect_marketplace_scrapes(self, pending: tuple, category: str) -> List[Dict]:
+        """Chờ các chợ đồ cũ trong phần ngân sách còn lại, đánh dấu listing là 'marketplace'"""
+        futures, deadline = pending
+        results = []
+        if not futures:
+            return results
+        
+        try:
+            for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+                try:
+                    listings = self.filter_reasonable_prices(future.result(), category)
+                except Exception as e:
+                    logger.warning("Error scraping marketplace %s: %s", futures[future], e)
+                    continue
+                for listing in listings:
+                    listing.type = 'marketplace'
+                results.extend(listings)
+                logger.info("Found %s valid items from marketplace %s", len(listings), futures[future])
+        except FuturesTimeoutError:
+            logger.info("Marketplaces exceeded %ss budget", self.marketplace_budget)
+        finally:
+            for future in futures:
+                future.cancel()
+        
+        self.listing_corpus.add(results, self.normalize_text)
+        return results
+    
+    def store_price_range(self, cache_key: str, price_range: Dict, success: bool, degraded: Optional[str] = None) -> None:
+        """Ghi khoảng giá vào chỉ mục; degraded ('stale', 'estimated', 'overloaded') hết hạn sau degraded_range_ttl"""
+        self.price_ranges.pop(cache_key, None)  # Ghi lại ở cuối để thứ tự dict là thứ tự ghi
+        self.price_ranges[cache_key] = (price_range.get('min_price'), price_range.get('max_price'),
+                                        price_range.get('recommended_price'), success, time.time(), degraded)
+        while len(self.price_ranges) > self.max_price_ranges:
+            try:
+                self.price_ranges.pop(next(iter(self.price_ranges)), None)
+            except (StopIteration, RuntimeError):  # Luồng khác vừa ghi/xóa cùng lúc
+                break
+    
+    def lookup_price_range(self, product_name: str, condition: str) -> Optional[Dict]:
+        """Khoảng giá còn hạn từ chỉ mục (không scrape), None nếu chưa có
+        
+        'degraded' == 'overloaded' nghĩa là lần tính nền gần nhất bị từ chối vì quá tải (không có khoảng giá)
+        """
+        cache_key = f"{self.canonicalize_query(product_name) or product_name}_{condition}"
+        entry = self.price_ranges.get(cache_key)
+        if entry is None:
+            return None
+        min_price, max_price, recommended_price, success, timestamp, degraded = entry
+        if time.time() - timestamp >= (self.degraded_range_ttl if degraded else self.cache_duration):
+            self.price_ranges.pop(cache_key, None)
+            return None
+        price_range = {
+            'min_price': min_price,
+            'max_price': max_price,
+            'recommended_price': recommended_price,
+            'success': success
+        }
+        if degraded:
+            price_range['degraded'] = degraded
+        return price_range
+    
+    def fill_price_range_async(self, product_name: str, condition: str) -> None:
+        """Tính gợi ý giá ở luồng nền (ưu tiên batch) để lần kiểm tra sau có sẵn khoảng giá; bỏ qua nếu đang tính
+        
+        Kết quả degraded hoặc bị từ chối vì quá tải cũng được ghi (hạn ngắn) để client đang hỏi lại không chờ mãi
+        """
+        cache_key = f"{self.canonicalize_query(product_name) or product_name}_{condition}"
+        with self._range_fill_lock:
+            if cache_key in self._range_fills:
+                return
+            self._range_fills.add(cache_key)
+        
+        def fill():
+            try:
+                with fetch_priority('batch'):
+                    result = self.get_price_suggestion(product_name, condition)
+                # Ghi cả khi trả từ cache: chỉ mục có giới hạn nên khóa có thể đã bị loại dù cache vẫn còn
+                self.store_price_range(cache_key, result['price_range'], result['success'], result.get('degraded'))
+            except EngineOverloaded:
+                self.store_price_range(cache_key, {}, False, 'overloaded')
+            except Exception as e:
+                logger.warning("Error filling price range for %s: %s", cache_key, e)
+            finally:
+                with self._range_fill_lock:
+                    self._range_fills.discard(cache_key)
+        
+        self._range_fill_pool.submit(fill)
+    
+    def get_price_history(self, product_name: str, days: int = 30) -> Dict:
+        """Lấy diễn biến giá thị trường theo ngày của một sản phẩm"""
+        canonical_query = self.canonicalize_query(product_name) or product_name
+        buckets = self.price_history.query(canonical_query, days)
+        
+        trend = None
+        if len(buckets) >= 2 and buckets[0]['median_price']:
+            first, last = buckets[0]['median_price'], buckets[-1]['median_price']
+            trend = {
+                'change': last - first,
+                'change_percent': round((last - first) / first * 100, 2)
+            }
+        
+        return {
             'product_name': product_name,
-            'condition': condition,
-            'category': category,
-            'category_name': category_info['name'],
-            'price_range': price_range,
-            'sources': sources[:15],  # Lấy tối đa 15 nguồn
-            'timestamp': datetime.now().isoformat(),
-            'success': len(all_prices) > 0,
-            'data_sources_used': data_sources_used
+            'canonical_query': canonical_query,
+            'days': days,
+            'buckets': buckets,
+            'trend': trend,
+            'timestamp': datetime.now().isoformat()
         }
+    
+    def warm_up(self) -> None:
+        """Chạy thử các hàm nóng để biên dịch sẵn regex và CSS selector (gọi trước khi fork worker)"""
+        sample = ('<div class="product-item"><a class="product-name" href="/p">iPhone 13 128GB</a>'
+                  '<span class="price">15.990.000₫</span></div>') * 3
+        soup = BeautifulSoup(sample, 'html.parser')
+        self.find_product_containers(soup, 'warm-up')
+        for parser in (self.parse_phongvu, self.parse_cellphones, self.parse_tgdd, self.parse_generic_store):
+            parser(soup, 'iPhone 13', 5)
+        for text in ('15.990.000₫', '12 tr', '500k', '1,2 tỷ'):
+            self.extract_price_from_text(text)
+        self.detect_product_category('iPhone 13')
+        self.reference_prices.lookup('electronics', self.reference_tokens('iPhone 13 128GB'))
+    
+    def memory_usage(self) -> Dict:
+        """Kích thước các cấu trúc dữ liệu của engine (số phần tử, không phải byte)"""
+        now = datetime.now()
+        expired = listings = 0
+        for entry in list(dict.values(self.cache)):
+            listings += len(entry['data'].get('sources', ()))
+            if now - entry['timestamp'] >= timedelta(seconds=self.cache_duration):
+                expired += 1
         
-        # Lưu cache
-        self.cache[cache_key] = {
-            'data': result,
-            'timestamp': datetime.now()
+        return {
+            'cache': dict(self.cache.stats(), entries=len(self.cache), expired=expired, listings=listings),
+            'price_ranges': len(self.price_ranges),
+            'range_fills_in_flight': len(self._range_fills),
+            'query_popularity': len(self.query_popularity.counts),
+            'listing_corpus': self.listing_corpus.stats(),
+            'price_history': self.price_history.stats(),
+            'reference_prices': sum(len(table) for table in self.reference_prices.tables.values())
         }
+    
+    def save_snapshot(self, path: Optional[str] = None) -> Optional[str]:
+        """Ghi cache, chỉ mục khoảng giá, độ phổ biến, kho listing và lịch sử giá ra file (ghi file tạm rồi đổi tên)"""
+        path = path or self.snapshot_path
+        if not path:
+            return None
+        
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            cutoff = time.time() - self.cache_duration
+            blobs = []
+            header = {'created': time.time(), 'cache': {}, 'sections': {}}
+            offset = 0
+            
+            def add(blob):
+                nonlocal offset
+                blobs.append(blob)
+                offset += len(blob)
+                return [offset - len(blob), len(blob)]
+            
+            for key, blob, timestamp in self.cache.encoded_items(cutoff):
+                header['cache'][key] = add(blob) + [timestamp]
+            sections = {
+                'price_ranges': {key: entry[:5] for key, entry in list(self.price_ranges.items())
+                                 if entry[4] >= cutoff and not entry[5]},
+                'popularity': self.query_popularity.export(),
+                'corpus': self.listing_corpus.export(),
+                'history': self.price_history.export()
+            }
+            for name, data in sections.items():
+                header['sections'][name] = add(zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8')))
+            
+            header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+                f.write(header_bytes)
+                for blob in blobs:
+                    f.write(blob)
+            os.replace(temp_path, path)
+        
+        logger.info("Saved snapshot %s: %s cache entries, %s bytes in %.3fs",
+                    path, len(header['cache']), SNAPSHOT_PREFIX.size + len(header_bytes) + offset,
+                    time.perf_counter() - started)
+        return path
+    
+    def load_snapshot(self, path: Optional[str] = None) -> bool:
+        """Nạp snapshot: cache được ánh xạ bộ nhớ và giải mã khi dùng, kho listing và lịch sử nạp ngay
+        
+        Nạp đồng bộ vì create_app chạy ở master gunicorn trước khi fork: luồng nền ở master có thể đang giữ
+        khóa của kho listing/lịch sử lúc fork, hoặc chưa nạp xong, và worker sẽ nhận khóa bị treo hay dữ liệu rỗng
+        """
+        path = path or self.snapshot_path
+        started = time.perf_counter()
+        buffer = None
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, header_length = SNAPSHOT_PREFIX.unpack_from(buffer)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                logger.warning("Ignoring snapshot %s: unsupported format (version %s)", path, version)
+                buffer.close()
+                return False
+            header = json.loads(buffer[SNAPSHOT_PREFIX.size:SNAPSHOT_PREFIX.size + header_length])
+            base = SNAPSHOT_PREFIX.size + header_length
+            
+            def section(name):
+                offset, length = header['sections'][name]
+                return json.loads(zlib.decompress(buffer[base + offset:base + offset + length]))
+            
+            # Giải mã mọi phần trước khi ghi vào engine: file hỏng giữa chừng không để lại trạng thái dở dang
+            sections = {name: section(name) for name in ('price_ranges', 'popularity', 'corpus', 'history')}
+            pending = {key: (base + offset, length, timestamp)
+                       for key, (offset, length, timestamp) in header['cache'].items()}
+            
+            self.listing_corpus.restore(sections['corpus'])
+            self.price_history.restore(sections['history'])
+            self.query_popularity.restore(sections['popularity'])
+            for key, entry in sections['price_ranges'].items():
+                self.price_ranges.setdefault(key, tuple(entry[:5]) + (None,))
+            self.cache.attach(buffer, pending)
+        except FileNotFoundError:
+            logger.info("No snapshot at %s, starting cold", path)
+            return False
+        except (OSError, ValueError, TypeError, KeyError, struct.error, zlib.error) as e:
+            # Snapshot hỏng không được làm process không khởi động nổi: bỏ vùng ánh xạ, chạy với cache lạnh
+            logger.warning("Cannot load snapshot %s, starting cold: %s", path, e)
+            if buffer is not None and self.cache.buffer is not buffer:
+                buffer.close()
+            return False
         
-        logger.info(f"Generated price suggestion with {len(all_prices)} price points from {len(data_sources_used)} sources")
+        logger.info("Loaded snapshot %s (%s cache entries) in %.3fs",
+                    path, len(header['cache']), time.perf_counter() - started)
+        return True
+    
+    def start_snapshot_scheduler(self):
+        """Ghi snapshot định kỳ và khi process thoát"""
+        if not self.snapshot_path or (self._snapshot_thread and self._snapshot_thread.is_alive()):
+            return
+        
+        def run():
+            while True:
+                time.sleep(self.snapshot_interval)
+                try:
+                    self.save_snapshot()
+                except Exception as e:
+                    logger.error("Snapshot error: %s", e)
         
-        return result
+        self._snapshot_thread = threading.Thread(target=run, name='snapshot', daemon=True)
+        self._snapshot_thread.start()
+        atexit.register(self.save_snapshot)
+    
+    def refresh_hot_entries(self) -> int:
+        """Làm mới các cache entry phổ biến sắp hết hạn, trong giới hạn ngân sách"""
+        refreshed = 0
+        refresh_after = timedelta(seconds=self.cache_duration - self.refresh_ahead_seconds)
+        
+        for cache_key, count, last_seen in self.query_popularity.top(self.refresh_top_k):
+            if refreshed >= self.refresh_budget_per_cycle:
+                break
+            
+            cached_data = self.cache.get(cache_key)
+            if not cached_data or datetime.now() - cached_data['timestamp'] < refresh_after:
+                continue
+            # Không ai hỏi lại kể từ lần tính/làm mới trước: để entry hết hạn thay vì scrape mãi
+            if last_seen < cached_data['timestamp'].timestamp():
+                continue
+            
+            try:
+                logger.info("Refreshing hot entry %s (%s queries)", cache_key, count)
+                self.compute_price_suggestion(self.expand_query(cached_data['product_name']), cached_data['condition'],
+                                              cached_data['canonical_query'], cache_key, use_corpus=False, degrade=False)
+                refreshed += 1
+            except Exception as e:
+                logger.warning("Error refreshing %s: %s", cache_key, e)
+        
+        return refreshed
+    
+    def start_refresh_scheduler(self):
+        """Chạy luồng nền làm mới trước hạn các sản phẩm phổ biến"""
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        
+        def run():
+            while True:
+                time.sleep(self.refresh_interval)
+                try:
+                    with fetch_priority('background'):
+                        self.refresh_hot_entries()
+                except Exception as e:
+                    logger.error("Refresh scheduler error: %s", e)
+        
+        self._refresh_thread = threading.Thread(target=run, name='refresh-ahead', daemon=True)
+        self._refresh_thread.start()
     
     def filter_reasonable_prices(self, data: List[Dict], category: str) -> List[Dict]:
         """Lọc giá hợp lý theo danh mục"""
@@ -1184,94 +3240,148 @@ class PriceSuggestionEngine:
             if range_config['min'] <= price <= range_config['max']:
                 filtered_data.append(item)
         
-        logger.info(f"Filtered {len(filtered_data)}/{len(data)} items within reasonable price range for {category}")
+        logger.debug("Filtered %s/%s items within reasonable price range for %s", len(filtered_data), len(data), category)
         return filtered_data
     
     def generate_category_based_estimates(self, product_name: str, category: str, condition: str) -> List[Dict]:
         """Tạo giá ước tính dựa trên danh mục và tên sản phẩm"""
         results = []
-        normalized_query = self.normalize_text(product_name)
-        
-        # Database giá ước tính theo danh mục
-        category_estimates = {
-            'electronics': {
-                'iphone 16': [25000000, 35000000, 45000000],
-                'iphone 15': [20000000, 28000000, 35000000],
-                'iphone 14': [15000000, 22000000, 28000000],
-                'iphone 13': [12000000, 18000000, 22000000],
-                'samsung galaxy s24': [15000000, 22000000, 28000000],
-                'samsung galaxy s23': [12000000, 18000000, 24000000],
-                'macbook air': [20000000, 30000000, 45000000],
-                'macbook pro': [35000000, 50000000, 80000000],
-                'laptop dell': [10000000, 20000000, 35000000],
-                'laptop hp': [8000000, 15000000, 25000000],
-                'airpods': [3000000, 5000000, 8000000],
-                'default': [1000000, 8000000, 20000000]
-            },
-            'home_appliances': {
-                'tu lanh': [8000000, 15000000, 30000000],
-                'may giat': [6000000, 12000000, 25000000],
-                'dieu hoa': [5000000, 10000000, 20000000],
-                'ti vi': [4000000, 8000000, 15000000],
-                'default': [2000000, 8000000, 20000000]
-            },
-            'fashion': {
-                'giay nike': [1500000, 3000000, 6000000],
-                'giay adidas': [1200000, 2500000, 5000000],
-                'tui xach': [500000, 2000000, 10000000],
-                'dong ho': [1000000, 5000000, 20000000],
-                'default': [200000, 1000000, 5000000]
-            },
-            'vehicles': {
-                'honda': [25000000, 50000000, 100000000],
-                'yamaha': [20000000, 40000000, 80000000],
-                'toyota': [400000000, 800000000, 1500000000],
-                'default': [30000000, 100000000, 500000000]
-            },
-            'real_estate': {
-                'can ho': [2000000000, 4000000000, 8000000000],
-                'nha': [1500000000, 3000000000, 6000000000],
-                'dat': [500000000, 2000000000, 5000000000],
-                'default': [1000000000, 3000000000, 8000000000]
-            },
-            'beauty_health': {
-                'my pham': [200000, 1000000, 3000000],
-                'nuoc hoa': [500000, 2000000, 8000000],
-                'default': [100000, 500000, 2000000]
-            }
-        }
         
-        # Tìm giá ước tính phù hợp trong danh mục
-        estimates = category_estimates.get(category, category_estimates['electronics'])
-        found_prices = None
-        
-        for keyword, prices in estimates.items():
-            if keyword == 'default':
-                continue
-            if any(word in normalized_query for word in keyword.split()):
-                found_prices = prices
-                break
+        # Tìm model khớp cụ thể nhất trong bảng giá tham khảo
+        found_prices = self.reference_prices.lookup(category, self.reference_tokens(product_name))
         
         # Sử dụng giá mặc định nếu không tìm thấy
         if not found_prices:
-            found_prices = estimates.get('default', [1000000, 5000000, 15000000])
+            found_prices = [1000000, 5000000, 15000000]
         
         # Tạo kết quả ước tính
         for i, price in enumerate(found_prices):
-            results.append({
-                'title': f"{product_name} - Estimated price {i+1} ({category})",
-                'price': price,
-                'source': f'Estimated Data ({category})',
-                'url': 'internal_estimation',
-                'type': 'estimated'
-            })
+            results.append(Listing(
+                title=f"{product_name} - Estimated price {i+1} ({category})",
+                price=price,
+                source=f'Estimated Data ({category})',
+                url='internal_estimation',
+                type='estimated'
+            ))
         
         return results
 
-# Khởi tạo engine
-price_engine = PriceSuggestionEngine()
+# Các route của API, được gắn vào app trong create_app
+api = Blueprint('api', __name__)
+
+def get_engine() -> PriceSuggestionEngine:
+    return current_app.extensions['price_engine']
+
+def suggest_price(product_name: str, condition: str) -> Dict:
+    """Gọi engine; kết quả bị hạ cấp do quá tải được đánh dấu thêm bằng header X-Price-Degraded"""
+    result = get_engine().get_price_suggestion(product_name, condition)
+    if result.get('degraded'):
+        g.degraded = result['degraded']
+    return result
+
+def forward_to_owner(product_name: str) -> Optional[Response]:
+    """Ở chế độ sharding: chuyển request tới instance sở hữu sản phẩm, None nếu tự xử lý"""
+    router = current_app.extensions.get('shard_router')
+    if router is None or ShardRouter.FORWARDED_HEADER in request.headers:
+        return None
+    
+    owner = router.owner(get_engine().canonicalize_query(product_name) or product_name)
+    if owner == router.self_url:
+        return None
+    
+    try:
+        upstream = router.forward(owner, request)
+    except (requests.ConnectionError, requests.ConnectTimeout) as e:
+        # Không kết nối được: loại peer khỏi vòng một lúc và tự xử lý request này
+        logger.warning("Shard owner %s unreachable, serving locally: %s", owner, e)
+        router.mark_down(owner)
+        SHARD_FORWARDS.inc('failed')
+        return None
+    except requests.RequestException as e:
+        # Peer còn sống nhưng chậm hoặc trả lỗi giữa chừng: giữ trong vòng, chỉ tự xử lý request này
+        logger.warning("Shard owner %s failed to answer, serving locally: %s", owner, e)
+        SHARD_FORWARDS.inc('failed')
+        return None
+    
+    SHARD_FORWARDS.inc('forwarded')
+    response = Response(upstream.content, status=upstream.status_code)
+    for name in ShardRouter.RESPONSE_HEADERS:
+        if name in upstream.headers:
+            response.headers[name] = upstream.headers[name]
+    response.headers['X-Price-Shard'] = owner
+    return response
+
+def overloaded_response(error: EngineOverloaded):
+    response = jsonify({'error': 'Service overloaded, please retry later', 'retry_after': error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.headers.get('X-Debug-Timings', '').lower() in ('1', 'true', 'yes'):
+        g.timings_token = _request_timings.set(RequestTimings())
+
+@api.after_app_request
+def finalize_response(response):
+    # Gắn object `timings` vào response JSON khi client yêu cầu
+    token = g.pop('timings_token', None)
+    if token is not None:
+        timings = _request_timings.get()
+        _request_timings.reset(token)
+        data = response.get_json(silent=True) if response.is_json else None
+        if isinstance(data, dict):
+            data['timings'] = timings.to_dict()
+            response.set_data(current_app.json.dumps(data))
+    
+    degraded = g.pop('degraded', None)
+    if degraded:
+        response.headers['X-Price-Degraded'] = degraded
+    
+    response = compress_response(response)
+    
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method)
+    return response
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain', 'text/html')
+COMPRESS_MIN_SIZE = 500
+
+def compress_response(response):
+    """Nén body bằng brotli (nếu có thư viện) hoặc gzip theo Accept-Encoding"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def is_admin_request() -> bool:
+    """Admin: header X-Admin-Token khớp PRICE_ADMIN_TOKEN; chưa đặt token thì mọi endpoint admin đều bị từ chối
+    
+    Không tin địa chỉ localhost: sau reverse proxy mọi request đều đến từ 127.0.0.1
+    """
+    admin_token = os.environ.get('PRICE_ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), admin_token.encode())
 
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def root():
     """Root endpoint để kiểm tra API"""
     return jsonify({
@@ -1279,26 +3389,36 @@ def root():
         'version': '1.0.0',
         'endpoints': {
             '/health': 'Health check',
-            '/api/price-suggestion': 'Get price suggestions (GET for info, POST for data)',
-            '/api/validate-price': 'Validate user price (GET for info, POST for validation)'
+            '/api/price-suggestion': 'Get price suggestions (GET ?product_name=...&condition=... or POST)',
+            '/api/validate-price': 'Validate user price (GET for info, POST for validation)',
+            '/api/validate-prices': 'Bulk validation (POST CSV or NDJSON rows, streams NDJSON verdicts)',
+            '/api/price-history': 'Daily market price history (GET ?product_name=...&days=30)',
+            '/metrics': 'Prometheus metrics',
+            '/admin/profile': 'Sampling profile of the live process (admin, ?seconds=10)',
+            '/admin/peers': 'Sharding peer list (admin, GET or PUT {"peers": [...]})',
+            '/admin/memory': 'Engine structure sizes and tracemalloc snapshots/diffs (admin, GET or POST {"action": ...})'
         },
         'timestamp': datetime.now().isoformat()
     })
 
-@app.route('/api/price-suggestion', methods=['GET', 'POST'])
+@api.route('/api/price-suggestion', methods=['GET', 'POST'])
 def get_price_suggestion():
     """API endpoint để lấy gợi ý giá"""
     try:
         if request.method == 'GET':
+            if 'product_name' in request.args:
+                return get_cacheable_price_suggestion()
+            
             # Test endpoint với GET method
             return jsonify({
                 'message': 'Price Suggestion API is running',
-                'methods': ['POST'],
+                'methods': ['GET', 'POST'],
                 'example_request': {
                     'product_name': 'iPhone 13',
                     'condition': 'nhu-moi'
                 },
-                'conditions': list(price_engine.condition_multipliers.keys())
+                'example_get': '/api/price-suggestion?product_name=iPhone%2013&condition=nhu-moi',
+                'conditions': list(get_engine().condition_multipliers.keys())
             })
         
         data = request.get_json()
@@ -1315,15 +3435,107 @@ def get_price_suggestion():
         if not condition:
             return jsonify({'error': 'Condition is required'}), 400
         
-        result = price_engine.get_price_suggestion(product_name, condition)
+        forwarded = forward_to_owner(product_name)
+        if forwarded is not None:
+            return forwarded
+        
+        result = suggest_price(product_name, condition)
         
         return jsonify(result)
     
+    except EngineOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
-        logger.error(f"API Error: {e}")
+        logger.error("API Error: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-@app.route('/api/validate-price', methods=['GET', 'POST'])
+def get_cacheable_price_suggestion():
+    """GET /api/price-suggestion?product_name=...&condition=...: có ETag/Last-Modified để browser và proxy cache"""
+    engine = get_engine()
+    product_name = ' '.join(request.args.get('product_name', '').split())
+    condition = request.args.get('condition', '').strip()
+    
+    if not product_name:
+        return jsonify({'error': 'Product name is required'}), 400
+    
+    if not condition:
+        return jsonify({'error': 'Condition is required'}), 400
+    
+    forwarded = forward_to_owner(product_name)
+    if forwarded is not None:
+        return forwarded
+    
+    result = suggest_price(product_name, condition)
+    if result.get('degraded'):
+        # Kết quả tạm thời khi quá tải: không để browser/proxy giữ lại
+        response = jsonify(result)
+        response.cache_control.no_store = True
+        return response
+    
+    # Các cách viết khác nhau của cùng sản phẩm dùng chung cache entry nên chung ETag
+    generated_at = datetime.fromisoformat(result['timestamp'])
+    etag = hashlib.sha1(f"{result['canonical_query']}|{condition}|{result['timestamp']}".encode('utf-8')).hexdigest()
+    max_age = int(engine.cache_duration - (datetime.now() - generated_at).total_seconds())
+    
+    response = jsonify(result)
+    response.set_etag(etag, weak=True)
+    response.last_modified = generated_at.astimezone(timezone.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = max(max_age, 0)
+    response.headers['Content-Location'] = '/api/price-suggestion?' + urllib.parse.urlencode(
+        [('condition', condition), ('product_name', result['canonical_query'])]
+    )
+    return response.make_conditional(request)
+
+def classify_price(user_price: float, price_range: Dict) -> Dict:
+    """Phân loại giá người dùng nhập so với khoảng giá thị trường"""
+    min_price = price_range['min_price']
+    max_price = price_range['max_price']
+    recommended_price = price_range['recommended_price']
+    
+    # Phân loại giá
+    if user_price > max_price * 1.3:  # Cao hơn 130% giá tối đa
+        return {
+            'status': 'too_high',
+            'message': f'Giá quá cao so với thị trường! Giá đề xuất: {recommended_price:,}₫',
+            'icon': '🚫',
+            'recommended_price': recommended_price,
+            'max_safe_price': max_price
+        }
+    elif user_price > max_price:  # Cao hơn giá tối đa nhưng < 130%
+        return {
+            'status': 'high',
+            'message': f'Giá hơi cao. Giá đề xuất: {recommended_price:,}₫',
+            'icon': '⚠️',
+            'recommended_price': recommended_price,
+            'max_safe_price': max_price
+        }
+    elif user_price < min_price * 0.7:  # Thấp hơn 70% giá tối thiểu
+        return {
+            'status': 'too_low',
+            'message': f'Giá quá thấp! Bạn có thể bán với giá cao hơn: {recommended_price:,}₫',
+            'icon': '💡',
+            'recommended_price': recommended_price,
+            'min_safe_price': min_price
+        }
+    elif min_price <= user_price <= max_price:  # Trong khoảng hợp lý
+        return {
+            'status': 'good',
+            'message': 'Giá hợp lý! Sản phẩm có thể bán nhanh',
+            'icon': '✅',
+            'recommended_price': recommended_price
+        }
+    else:  # Các trường hợp khác
+        return {
+            'status': 'acceptable',
+            'message': f'Giá chấp nhận được. Giá đề xuất: {recommended_price:,}₫',
+            'icon': '👍',
+            'recommended_price': recommended_price
+        }
+
+VALIDATE_RETRY_AFTER = 2  # Giây; gợi ý cho client khi validate_price trả 'pending'
+
+@api.route('/api/validate-price', methods=['GET', 'POST'])
 def validate_price():
     """API endpoint để kiểm tra giá người dùng nhập"""
     try:
@@ -1334,7 +3546,8 @@ def validate_price():
                 'example_request': {
                     'product_name': 'iPhone 13',
                     'condition': 'nhu-moi',
-                    'price': 15000000
+                    'price': 15000000,
+                    'wait': False  # Tùy chọn: trả 'pending' thay vì chờ scrape khi chưa có dữ liệu
                 }
             })
             
@@ -1354,69 +3567,459 @@ def validate_price():
                 'icon': '⚠️'
             }), 400
         
-        # Lấy gợi ý giá
-        suggestion = price_engine.get_price_suggestion(product_name, condition)
+        forwarded = forward_to_owner(product_name)
+        if forwarded is not None:
+            return forwarded
+        
+        # Tra chỉ mục khoảng giá trước; chỉ khi chưa có mới cần tính gợi ý giá
+        engine = get_engine()
+        price_range = engine.lookup_price_range(product_name, condition)
+        if price_range is not None and price_range.get('degraded') == 'overloaded':
+            if data.get('wait') is False:
+                # Lần tính nền vừa bị từ chối: báo quá tải thay vì để client hỏi lại mãi
+                raise EngineOverloaded(engine.admission.retry_after)
+            price_range = None
+        elif price_range is not None and price_range.get('degraded'):
+            g.degraded = price_range['degraded']
+        if price_range is None:
+            if data.get('wait') is False:
+                # Không chặn người dùng đang nhập giá: tính nền, client hỏi lại sau
+                engine.fill_price_range_async(product_name, condition)
+                return jsonify({
+                    'status': 'pending',
+                    'message': 'Đang lấy giá thị trường, vui lòng đợi trong giây lát',
+                    'icon': '⏳',
+                    'retry_after': VALIDATE_RETRY_AFTER
+                }), 202
+            
+            suggestion = suggest_price(product_name, condition)
+            price_range = dict(suggestion['price_range'], success=suggestion['success'])
         
-        if not suggestion['success']:
+        if not price_range['success']:
             return jsonify({
                 'status': 'no_data',
                 'message': 'Không tìm thấy dữ liệu tham khảo cho sản phẩm này',
                 'icon': '⚠️'
             })
         
-        price_range = suggestion['price_range']
-        min_price = price_range['min_price']
-        max_price = price_range['max_price']
-        recommended_price = price_range['recommended_price']
+        return jsonify(classify_price(user_price, price_range))
+    
+    except EngineOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error("Validation Error: %s", e)
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+BULK_WINDOW_ROWS = 200  # Số dòng đọc vào mỗi lượt: bộ nhớ không phụ thuộc kích thước file
+BULK_WORKERS = 2  # Không vượt MAX_BATCH_SCRAPES: nhóm thừa chỉ nằm chờ slot admission
+BULK_SPOOL_MEMORY = 1024 * 1024  # Body lớn hơn được ghi tạm ra đĩa
+
+def read_bulk_rows(stream, content_type: str):
+    """Đọc lần lượt từng dòng của body CSV (có header) hoặc NDJSON; dòng JSON lỗi trả về None
+    
+    Không đóng `stream` khi dừng giữa chừng, để có thể seek lại và đọc lần nữa
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        if 'csv' in content_type:
+            yield from csv.DictReader(text)
+            return
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+    finally:
+        text.detach()
+
+def parse_bulk_row(row) -> tuple:
+    """(product_name, condition, price) hoặc raise ValueError với lý do"""
+    if not isinstance(row, dict):
+        raise ValueError('Invalid row')
+    product_name = ' '.join(str(row.get('product_name') or '').split())
+    condition = str(row.get('condition') or '').strip()
+    if not product_name or not condition:
+        raise ValueError('Missing product_name or condition')
+    try:
+        price = float(row.get('price') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid price')
+    if price <= 0:
+        raise ValueError('Invalid price')
+    return product_name, condition, int(price) if price.is_integer() else price
+
+def bulk_verdicts(engine: PriceSuggestionEngine, rows):
+    """Sinh kết quả từng dòng: mỗi cửa sổ dòng được gom theo sản phẩm chuẩn hóa, mỗi nhóm chỉ tính giá một lần"""
+    numbered = enumerate(rows, 1)
+    
+    def resolve(product_name, condition):
+        price_range = engine.lookup_price_range(product_name, condition)
+        if price_range is not None and price_range.get('degraded') != 'overloaded':
+            return price_range
+        with fetch_priority('batch'):
+            suggestion = engine.get_price_suggestion(product_name, condition)
+        return dict(suggestion['price_range'], success=suggestion['success'], degraded=suggestion.get('degraded'))
+    
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='bulk-validate') as pool:
+        while True:
+            window = list(islice(numbered, BULK_WINDOW_ROWS))
+            if not window:
+                break
+            
+            groups = {}  # (canonical_query, condition) -> các dòng (số dòng, tên, tình trạng, giá)
+            for number, row in window:
+                try:
+                    product_name, condition, price = parse_bulk_row(row)
+                except ValueError as e:
+                    yield {'row': number, 'status': 'invalid_row', 'error': str(e)}
+                    continue
+                key = (engine.canonicalize_query(product_name) or product_name, condition)
+                groups.setdefault(key, []).append((number, product_name, condition, price))
+            
+            futures = {pool.submit(contextvars.copy_context().run, resolve, members[0][1], members[0][2]): members
+                       for members in groups.values()}
+            for future in as_completed(futures):
+                members = futures[future]
+                try:
+                    price_range = future.result()
+                except EngineOverloaded as e:
+                    for number, product_name, condition, price in members:
+                        yield {'row': number, 'product_name': product_name, 'status': 'overloaded',
+                               'retry_after': e.retry_after}
+                    continue
+                except Exception as e:
+                    logger.error("Bulk validation error: %s", e)
+                    for number, product_name, condition, price in members:
+                        yield {'row': number, 'product_name': product_name, 'status': 'error'}
+                    continue
+                
+                for number, product_name, condition, price in members:
+                    verdict = {'row': number, 'product_name': product_name, 'condition': condition, 'price': price}
+                    if price_range['success']:
+                        verdict.update(classify_price(price, price_range))
+                    else:
+                        verdict['status'] = 'no_data'
+                    if price_range.get('degraded'):
+                        verdict['degraded'] = price_range['degraded']
+                    yield verdict
+
+@api.route('/api/validate-prices', methods=['POST'])
+def validate_prices_bulk():
+    """Kiểm tra giá hàng loạt: body CSV (product_name,condition,price) hoặc NDJSON, trả về NDJSON từng dòng khi có kết quả"""
+    content_type = request.mimetype or ''
+    if content_type not in ('text/csv', 'application/x-ndjson', 'application/jsonl'):
+        return jsonify({'error': 'Content-Type must be text/csv or application/x-ndjson'}), 415
+    
+    max_bytes = current_app.config['MAX_BULK_BYTES']
+    max_rows = current_app.config['MAX_BULK_ROWS']
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({'error': f'Body larger than {max_bytes} bytes'}), 413
+    
+    # Nhận hết body trước khi trả kết quả: client thường chỉ đọc response sau khi gửi xong,
+    # ghi response trong lúc đang nhận sẽ làm cả hai bên tắc khi buffer socket đầy
+    spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MEMORY)
+    received = 0
+    while True:
+        chunk = request.stream.read(64 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > max_bytes:  # Body chunked không có Content-Length
+            spool.close()
+            return jsonify({'error': f'Body larger than {max_bytes} bytes'}), 413
+        spool.write(chunk)
+    
+    # Đếm dòng trước khi bắt đầu stream để còn trả được mã lỗi
+    spool.seek(0)
+    row_count = sum(1 for _ in islice(read_bulk_rows(spool, content_type), max_rows + 1))
+    if row_count > max_rows:
+        spool.close()
+        return jsonify({'error': f'At most {max_rows} rows per request'}), 400
+    spool.seek(0)
+    
+    engine = get_engine()
+    rows = read_bulk_rows(spool, content_type)
+    
+    def generate():
+        try:
+            for verdict in bulk_verdicts(engine, rows):
+                yield json.dumps(verdict, ensure_ascii=False) + '\n'
+        finally:
+            spool.close()
+    
+    return Response(stream_with_context(generate()), content_type='application/x-ndjson; charset=utf-8')
+
+@api.route('/api/price-history', methods=['GET'])
+def get_price_history():
+    """API endpoint để xem diễn biến giá theo ngày"""
+    try:
+        product_name = request.args.get('product_name', '').strip()
+        if not product_name:
+            return jsonify({'error': 'Product name is required'}), 400
         
-        # Phân loại giá
-        if user_price > max_price * 1.3:  # Cao hơn 130% giá tối đa
-            return jsonify({
-                'status': 'too_high',
-                'message': f'Giá quá cao so với thị trường! Giá đề xuất: {recommended_price:,}₫',
-                'icon': '🚫',
-                'recommended_price': recommended_price,
-                'max_safe_price': max_price
-            })
-        elif user_price > max_price:  # Cao hơn giá tối đa nhưng < 130%
-            return jsonify({
-                'status': 'high',
-                'message': f'Giá hơi cao. Giá đề xuất: {recommended_price:,}₫',
-                'icon': '⚠️',
-                'recommended_price': recommended_price,
-                'max_safe_price': max_price
-            })
-        elif user_price < min_price * 0.7:  # Thấp hơn 70% giá tối thiểu
-            return jsonify({
-                'status': 'too_low',
-                'message': f'Giá quá thấp! Bạn có thể bán với giá cao hơn: {recommended_price:,}₫',
-                'icon': '💡',
-                'recommended_price': recommended_price,
-                'min_safe_price': min_price
-            })
-        elif min_price <= user_price <= max_price:  # Trong khoảng hợp lý
-            return jsonify({
-                'status': 'good',
-                'message': 'Giá hợp lý! Sản phẩm có thể bán nhanh',
-                'icon': '✅',
-                'recommended_price': recommended_price
-            })
-        else:  # Các trường hợp khác
-            return jsonify({
-                'status': 'acceptable',
-                'message': f'Giá chấp nhận được. Giá đề xuất: {recommended_price:,}₫',
-                'icon': '👍',
-                'recommended_price': recommended_price
-            })
+        days = request.args.get('days', 30, type=int)
+        if days <= 0:
+            return jsonify({'error': 'days must be a positive integer'}), 400
+        
+        return jsonify(get_engine().get_price_history(product_name, days))
     
     except Exception as e:
-        logger.error(f"Validation Error: {e}")
+        logger.error("History Error: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-@app.route('/health', methods=['GET'])
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics dạng Prometheus text exposition"""
+    lookups = CACHE_LOOKUPS.collect()
+    total = sum(lookups.values())
+    lines = [
+        '# HELP price_cache_ratio Share of cache lookups by result since start',
+        '# TYPE price_cache_ratio gauge'
+    ]
+    for result in ('hit', 'miss', 'stale'):
+        ratio = lookups.get((result,), 0) / total if total else 0
+        lines.append(f'price_cache_ratio{{result="{result}"}} {ratio}')
+    
+    body = metrics.render() + '\n'.join(lines) + '\n'
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api.route('/admin/profile', methods=['GET'])
+def profile_process():
+    """Lấy mẫu stack của process trong N giây, trả về collapsed stack (dùng cho flamegraph)"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    seconds = min(request.args.get('seconds', 10, type=float), 60)
+    interval = max(request.args.get('interval_ms', 5, type=float), 1) / 1000
+    samples = sample_stacks(seconds, interval)
+    
+    body = ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
+    return Response(body, content_type='text/plain; charset=utf-8')
+
+def is_peer_url(url: str) -> bool:
+    """URL gốc của một instance: http(s)://host[:port], không có user/mật khẩu, query hay fragment"""
+    try:
+        parsed = urllib.parse.urlsplit(url.strip())
+        parsed.port
+    except ValueError:
+        return False
+    return (parsed.scheme in ('http', 'https') and bool(parsed.hostname) and parsed.username is None
+            and not parsed.query and not parsed.fragment and parsed.path in ('', '/'))
+
+@api.route('/admin/peers', methods=['GET', 'PUT'])
+def shard_peers():
+    """Xem hoặc thay danh sách instance của vòng sharding (PUT {"peers": [...]})"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    router = current_app.extensions.get('shard_router')
+    if router is None:
+        return jsonify({'error': 'Sharding is disabled (set PRICE_PEERS)'}), 404
+    
+    if request.method == 'PUT':
+        # Peer nhận request được chuyển tiếp (SSRF nếu ai cũng đổi được): luôn cần token, kể cả khi is_admin_request nới lỏng
+        if not os.environ.get('PRICE_ADMIN_TOKEN'):
+            return jsonify({'error': 'Set PRICE_ADMIN_TOKEN to change peers'}), 403
+        peers = (request.get_json(silent=True) or {}).get('peers')
+        if not isinstance(peers, list) or not all(isinstance(peer, str) and is_peer_url(peer) for peer in peers):
+            return jsonify({'error': 'peers must be a list of http(s) base URLs'}), 400
+        router.set_peers(peers)
+    
+    return jsonify({
+        'self': router.self_url,
+        'peers': router.peers,
+        'down': sorted(router.down)
+    })
+
+@api.route('/admin/memory', methods=['GET', 'POST'])
+def memory_introspection():
+    """Bộ nhớ của worker: kích thước cấu trúc engine, trạng thái tracemalloc; POST để bật/tắt, chụp và so sánh snapshot
+    
+    POST {"action": "start", "frames": 1} | {"action": "stop"} | {"action": "snapshot", "name": "a"}
+         | {"action": "diff", "base": "a", "against": "b"}  (bỏ "against" để so với thời điểm hiện tại)
+    GET ?objects=1 đếm thêm object còn sống theo kiểu (duyệt heap có giới hạn, kết quả dùng lại 30 giây)
+    
+    tracemalloc và các snapshot thuộc về từng worker: với nhiều worker gunicorn, các lệnh start/snapshot/diff
+    có thể rơi vào worker khác nhau. Mọi phản hồi đều có "pid"; muốn so sánh thì gọi thẳng một worker
+    (VD chạy thêm một instance --workers 1) hoặc lặp lại cho đến khi pid trùng
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if request.method == 'GET':
+        report = {
+            'pid': os.getpid(),
+            'process': process_memory(),
+            'engine': get_engine().memory_usage(),
+            'tracemalloc': allocation_tracer.status()
+        }
+        if request.args.get('objects', type=int):
+            objects = count_live_objects(('BeautifulSoup', 'Tag', 'NavigableString', 'Listing', 'traceback', 'frame'))
+            if objects is None:
+                return jsonify({'error': 'Object count already running in this worker', 'pid': os.getpid()}), 429
+            report['objects'] = objects
+        return jsonify(report)
+    
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    group_by = data.get('group_by', 'lineno')
+    try:
+        limit = min(max(int(data.get('limit', 25)), 1), 200)
+        frames = int(data.get('frames', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit and frames must be integers'}), 400
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'group_by must be lineno, filename or traceback'}), 400
+    
+    try:
+        if action == 'start':
+            allocation_tracer.start(frames)
+            result = {}
+        elif action == 'stop':
+            allocation_tracer.stop()
+            result = {}
+        elif action == 'snapshot':
+            snapshot = allocation_tracer.take(data.get('name') or datetime.now().strftime('%H%M%S'))
+            result = {'top': allocation_tracer.top(snapshot, group_by, limit)}
+        elif action == 'diff':
+            base = allocation_tracer.get(data.get('base', ''))
+            against = allocation_tracer.get(data['against']) if data.get('against') else allocation_tracer.take()
+            result = {'diff': allocation_tracer.diff(base, against, group_by, limit)}
+        else:
+            return jsonify({'error': 'action must be start, stop, snapshot or diff'}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e), 'pid': os.getpid()}), 409
+    except KeyError as e:
+        return jsonify({'error': f'Unknown snapshot in worker {os.getpid()}: {e.args[0]}', 'pid': os.getpid()}), 404
+    
+    return jsonify(dict(result, pid=os.getpid(), tracemalloc=allocation_tracer.status()))
+
+@api.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.time() - current_app.config['STARTED_AT'], 3),
+        'startup_seconds': current_app.config['STARTUP_SECONDS'],
+        'memory': process_memory(),
+        'cache_entries': len(get_engine().cache),
+        'timestamp': datetime.now().isoformat()
+    })
+
+def process_memory() -> Dict:
+    """Bộ nhớ của process hiện tại (kB); Private_* là phần riêng của worker, Shared_* là phần chia sẻ copy-on-write"""
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty'):
+                    memory[key.lower() + '_kb'] = int(rest.split()[0])
+    except OSError:
+        import resource  # Không có trên Windows, chỉ dùng khi thiếu /proc
+        memory['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return memory
+
+DEFAULT_CONFIG = {
+    'CACHE_DURATION': 3600,
+    'REQUEST_DELAY': 1,
+    'REFERENCE_PRICES_PATH': None,
+    'START_REFRESH_SCHEDULER': False,
+    'START_SNAPSHOT_SCHEDULER': False,  # Ghi snapshot định kỳ và khi thoát (gunicorn: bật trong post_worker_init)
+    'WARM_UP': True,
+    'MAX_CONCURRENT_SCRAPES': 4,
+    'MAX_QUEUED_SCRAPES': 16,
+    'MAX_BATCH_SCRAPES': 2,  # Số scrape batch/background (kiểm tra hàng loạt, làm mới nền) chạy cùng lúc
+    'MAX_BULK_BYTES': 5 * 1024 * 1024,  # Giới hạn body và số dòng của /api/validate-prices
+    'MAX_BULK_ROWS': 5000,
+    'SHED_WITH_ESTIMATES': True,  # False: trả 503 khi quá tải và không có kết quả cũ
+    'MAX_OUTBOUND_REQUESTS': 8,
+    'MAX_REQUESTS_PER_HOST': 2,
+    'MIN_SAMPLE_SIZE': 8,  # Ít listing hơn thì tải thêm trang kết quả (0: tắt)
+    'MAX_EXTRA_PAGES': 4,
+    'EXTRA_PAGE_BUDGET': 5.0,
+    'MARKETPLACE_WEIGHT': 0.5,  # Tỷ trọng giá chợ đồ cũ (Chợ Tốt, MuaBan) trong giá đề xuất
+    'MARKETPLACE_BUDGET': 10.0,
+    'CATEGORY_AMBIGUITY_RATIO': 0.75,  # Scrape song song hai danh mục khi điểm thứ hai >= tỉ lệ này (> 1: tắt)
+    'SNAPSHOT_PATH': None,  # VD: data/engine.snapshot; nạp khi khởi động, ghi định kỳ và khi thoát
+    'SNAPSHOT_INTERVAL': 300,
+    'PEERS': '',  # Bật sharding: URL các instance, phân tách bằng dấu phẩy (gồm cả SELF_URL)
+    'SELF_URL': '',
+    # Giây chờ peer trả lời: trên mức scrape lạnh xấu nhất (các nguồn tuần tự 10s + 1s nghỉ,
+    # 5s trang thêm, 5s chờ admission)
+    'SHARD_FORWARD_TIMEOUT': 90
+}
+
+def create_app(config: Optional[Dict] = None) -> Flask:
+    """Tạo Flask app cùng engine; với server prefork, gọi một lần ở master để worker dùng chung bộ nhớ"""
+    started = time.perf_counter()
+    
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.from_prefixed_env('PRICE')  # VD: PRICE_CACHE_DURATION=600
+    app.config.update(config or {})
+    CORS(app)
+    
+    engine = PriceSuggestionEngine()
+    engine.cache_duration = app.config['CACHE_DURATION']
+    engine.listing_corpus.max_age = engine.cache_duration
+    engine.request_delay = app.config['REQUEST_DELAY']
+    engine.admission.max_concurrent = app.config['MAX_CONCURRENT_SCRAPES']
+    engine.admission.max_queue = app.config['MAX_QUEUED_SCRAPES']
+    engine.admission.max_batch = app.config['MAX_BATCH_SCRAPES']
+    engine.shed_with_estimates = app.config['SHED_WITH_ESTIMATES']
+    engine.outbound.max_concurrent = app.config['MAX_OUTBOUND_REQUESTS']
+    engine.outbound.max_per_host = app.config['MAX_REQUESTS_PER_HOST']
+    engine.min_sample_size = app.config['MIN_SAMPLE_SIZE']
+    engine.max_extra_pages = app.config['MAX_EXTRA_PAGES']
+    engine.extra_page_budget = app.config['EXTRA_PAGE_BUDGET']
+    engine.marketplace_weight = app.config['MARKETPLACE_WEIGHT']
+    engine.marketplace_budget = app.config['MARKETPLACE_BUDGET']
+    engine.category_ambiguity_ratio = app.config['CATEGORY_AMBIGUITY_RATIO']
+    if app.config['REFERENCE_PRICES_PATH']:
+        engine.reference_prices.path = app.config['REFERENCE_PRICES_PATH']
+        engine.reference_prices.reload()
+    if app.config['SNAPSHOT_PATH']:
+        engine.snapshot_path = app.config['SNAPSHOT_PATH']
+        engine.snapshot_interval = app.config['SNAPSHOT_INTERVAL']
+        engine.load_snapshot()
+    if app.config['WARM_UP']:
+        engine.warm_up()
+    if app.config['START_REFRESH_SCHEDULER']:
+        engine.start_refresh_scheduler()
+    if app.config['START_SNAPSHOT_SCHEDULER']:
+        engine.start_snapshot_scheduler()
+    
+    app.extensions['price_engine'] = engine
+    
+    peers = app.config['PEERS']
+    if isinstance(peers, str):
+        peers = [peer for peer in peers.split(',') if peer.strip()]
+    if peers and app.config['SELF_URL']:
+        app.extensions['shard_router'] = ShardRouter(app.config['SELF_URL'], peers,
+                                                     timeout=app.config['SHARD_FORWARD_TIMEOUT'])
+    app.register_blueprint(api)
+    
+    app.config['STARTED_AT'] = time.time()
+    app.config['STARTUP_SECONDS'] = round(time.perf_counter() - started, 3)
+    logger.info("App ready in %ss, memory: %s", app.config['STARTUP_SECONDS'], process_memory())
+    return app
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+def __getattr__(name):
+    """`app` và `price_engine` cấp module được tạo khi dùng lần đầu, không phải lúc import"""
+    global _default_app
+    if name in ('app', 'price_engine'):
+        with _default_app_lock:
+            if _default_app is None:
+                _default_app = create_app()
+        return _default_app if name == 'app' else _default_app.extensions['price_engine']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=5000, debug=True)
+    create_app({'START_REFRESH_SCHEDULER': True, 'START_SNAPSHOT_SCHEDULER': True}).run(host='127.0.0.1', port=5000, debug=True)
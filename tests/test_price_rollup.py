@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Phân vị của PriceRollup: chính xác khi ít mẫu, P² sau ngưỡng EXACT_LIMIT"""
+
+import random
+import statistics
+
+from price_suggestion_api import PriceRollup
+
+def make_rollup(prices):
+    rollup = PriceRollup()
+    for price in prices:
+        rollup.add(price)
+    return rollup
+
+def test_small_samples_match_statistics_quantiles():
+    rng = random.Random(7)
+    for n in range(2, PriceRollup.EXACT_LIMIT + 1):
+        prices = [rng.randrange(1_000_000, 30_000_000, 10_000) for _ in range(n)]
+        summary = make_rollup(prices).to_dict()
+        expected = [int(value) for value in statistics.quantiles(prices, n=4, method='inclusive')]
+        assert [summary['p25_price'], summary['median_price'], summary['p75_price']] == expected
+
+def test_six_distinct_prices_give_distinct_quartiles():
+    summary = make_rollup([10, 20, 30, 40, 50, 60]).to_dict()
+    assert summary['p25_price'] < summary['median_price'] < summary['p75_price']
+
+def test_single_price():
+    summary = make_rollup([15_000_000]).to_dict()
+    assert summary['p25_price'] == summary['median_price'] == summary['p75_price'] == 15_000_000
+
+def test_switches_to_p2_and_survives_state_round_trip():
+    rng = random.Random(11)
+    prices = [rng.gauss(20_000_000, 2_000_000) for _ in range(500)]
+    rollup = make_rollup(prices)
+    assert rollup.samples is None
+
+    restored = PriceRollup.from_state(rollup.to_state())
+    assert restored.to_dict() == rollup.to_dict()
+    median = statistics.median(prices)
+    assert abs(rollup.to_dict()['median_price'] - median) / median < 0.05
+
+def test_small_rollup_survives_state_round_trip():
+    rollup = make_rollup([3, 1, 2])
+    assert PriceRollup.from_state(rollup.to_state()).to_dict() == rollup.to_dict()
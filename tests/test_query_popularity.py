@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Đếm độ phổ biến truy vấn (SpaceSavingCounter) và làm mới trước hạn"""
+
+from datetime import datetime, timedelta
+
+from price_suggestion_api import PriceSuggestionEngine, SpaceSavingCounter
+
+def test_counts_halve_and_cold_keys_drop_out():
+    counter = SpaceSavingCounter(capacity=10, decay_interval=3600)
+    for _ in range(8):
+        counter.add('hot')
+    counter.add('once')
+    counter.last_decay -= 3600 * 3
+    assert [(key, count) for key, count, _ in counter.top(10)] == [('hot', 1)]
+
+def test_restore_accepts_old_snapshot_state():
+    counter = SpaceSavingCounter()
+    counter.restore({'a_moi': [5, 0]})
+    assert counter.top(1) == [('a_moi', 5, 0)]
+
+def test_refresh_skips_entries_not_requested_since_last_refresh():
+    engine = PriceSuggestionEngine()
+    refreshed = []
+    engine.compute_price_suggestion = lambda *args, **kwargs: refreshed.append(args[3])
+    old = datetime.now() - timedelta(seconds=engine.cache_duration)
+    for key in ('asked_moi', 'idle_moi'):
+        engine.query_popularity.add(key)
+        engine.cache[key] = {'data': {}, 'timestamp': old, 'product_name': key[:-4],
+                             'canonical_query': key[:-4], 'condition': 'moi'}
+    engine.query_popularity.counts['idle_moi'] = (1, 0, old.timestamp() - 1)
+    
+    assert engine.refresh_hot_entries() == 1
+    assert refreshed == ['asked_moi']
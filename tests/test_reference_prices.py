@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Tra bảng giá tham khảo (data/reference_prices.json) theo tên sản phẩm"""
+
+import pytest
+
+from price_suggestion_api import PriceSuggestionEngine
+
+@pytest.fixture(scope='module')
+def engine():
+    return PriceSuggestionEngine()
+
+def lookup(engine, category, product_name):
+    return engine.reference_prices.lookup(category, engine.reference_tokens(product_name))
+
+def test_accented_name_matches_unaccented_key(engine):
+    assert lookup(engine, 'fashion', 'Đồng hồ Casio') == [1000000, 5000000, 20000000]
+    assert lookup(engine, 'real_estate', 'Đất nền Bình Dương') == [500000000, 2000000000, 5000000000]
+
+def test_unaccented_name_matches(engine):
+    assert lookup(engine, 'fashion', 'dong ho casio') == lookup(engine, 'fashion', 'Đồng hồ Casio')
+
+def test_extra_words_do_not_push_out_model_words(engine):
+    assert lookup(engine, 'electronics', 'a b c d e f g h i j iPhone 13 128GB') == [12000000, 18000000, 22000000]
+
+def test_unknown_model_falls_back_to_category_default(engine):
+    assert lookup(engine, 'fashion', 'Khăn quàng') == [200000, 1000000, 5000000]
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Entry point WSGI cho môi trường production
+Chạy: gunicorn -c gunicorn.conf.py
+"""
+
+from price_suggestion_api import create_app
+
+app = create_app()